@@ -8,7 +8,12 @@ LiDAR processing examples
 
 from __future__ import division
 
+import ast
+from multiprocessing.pool import ThreadPool
+import os
+import shutil
 import sys
+import tempfile
 
 import affine
 import click
@@ -17,6 +22,805 @@ import numpy as np
 import rasterio
 import rasterio.warp
 import scipy.interpolate
+import scipy.spatial
+
+
+# Per-cell statistics grids larger than this are memory-mapped to a temporary file
+MAX_IN_MEMORY_BYTES = 512 * 1024 ** 2
+
+# Point fields produced by `read_chunks()` and available to filter expressions
+FIELDS = ('x', 'y', 'z', 'intensity', 'classification', 'return_num', 'num_returns')
+
+# Fixed value ranges used by approximate percentiles for attributes whose
+# range is not stored in the LAS header
+ATTRIBUTE_RANGES = {
+    'intensity': (0, 65535),
+    'classification': (0, 255),
+    'return_num': (0, 15)
+}
+
+_COMPARISONS = {
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal
+}
+
+
+def _compile_operand(node):
+
+    """
+    Compile a field name or literal from a filter expression.  See
+    `compile_filter()`.
+    """
+
+    if isinstance(node, ast.Name):
+        if node.id not in FIELDS:
+            raise ValueError("Unknown field `%s' - must be one of: %s"
+                             % (node.id, ', '.join(FIELDS)))
+        return lambda get: get(node.id)
+
+    try:
+        value = ast.literal_eval(node)
+    except ValueError:
+        raise ValueError("Expected a field or a literal value")
+    if isinstance(value, (list, tuple, set)):
+        value = np.array(list(value))
+    return lambda get: value
+
+
+def _compile_node(node):
+
+    """
+    Compile a boolean node from a filter expression.  See `compile_filter()`.
+    """
+
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile_node(n) for n in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+        def evaluate(get):
+            out = parts[0](get)
+            for part in parts[1:]:
+                out = combine(out, part(get))
+            return out
+
+        return evaluate
+
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        operand = _compile_node(node.operand)
+        return lambda get: np.logical_not(operand(get))
+
+    elif isinstance(node, ast.Compare):
+        operands = [_compile_operand(n) for n in [node.left] + node.comparators]
+        tests = []
+        for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                invert = isinstance(op, ast.NotIn)
+                tests.append(
+                    lambda get, l=left, r=right, i=invert: np.isin(l(get), r(get), invert=i))
+            elif type(op) in _COMPARISONS:
+                tests.append(lambda get, l=left, r=right, f=_COMPARISONS[type(op)]: f(l(get), r(get)))
+            else:
+                raise ValueError("Unsupported comparison: %s" % type(op).__name__)
+
+        # Chained comparisons like `0 < z < 100` are combined with `and`
+        def evaluate(get):
+            out = tests[0](get)
+            for test in tests[1:]:
+                out = np.logical_and(out, test(get))
+            return out
+
+        return evaluate
+
+    raise ValueError("Unsupported expression: %s" % type(node).__name__)
+
+
+def compile_filter(expression):
+
+    """
+    Compile a point filter expression into a function producing a boolean
+    mask for a chunk of points.
+
+    Expressions use Python syntax and support `and`, `or`, `not`,
+    parentheses, comparisons including chained comparisons like
+    `0 < z < 100`, and `in` or `not in` with a literal sequence.  Names refer
+    to `FIELDS`.  For example:
+
+        classification in (2, 9) and return_num == 1 and z < 3000
+
+    The expression is parsed and compiled once into vectorized NumPy
+    operations and is never passed to `eval()`.
+
+    Parameters
+    ----------
+    expression : str
+        Filter expression.
+
+    Raises
+    ------
+    ValueError
+        If the expression is invalid or uses unsupported syntax or fields.
+
+    Returns
+    -------
+    callable
+        Takes a function mapping a field name to an array and returns a
+        boolean array.  See `read_chunks()`.
+    """
+
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ValueError("Invalid expression: %s" % e)
+    return _compile_node(tree.body)
+
+
+def read_chunks(las, chunk_size, fields=FIELDS, where=None):
+
+    """
+    Read points in chunks without loading entire dimensions into memory.
+
+    `laspy` memory-maps the raw point records, but the scaled `las.x` and the
+    bit field accessors like `las.classification` produce full copies of
+    every point.  Slicing the raw dimensions first and scaling or unpacking
+    only the slice keeps memory proportional to `chunk_size`.
+
+    When filtering, only the fields referenced by `where` are decoded to
+    compute the mask, and every requested field is gathered once with the
+    mask before it is scaled.
+
+    Parameters
+    ----------
+    las : laspy.file.File
+        Open LAS file.
+    chunk_size : int
+        Maximum number of points per chunk.
+    fields : tuple, optional
+        Fields to read.  See `FIELDS`.
+    where : callable or None, optional
+        Point filter from `compile_filter()`.
+
+    Yields
+    ------
+    dict
+        Requested fields.  `x`, `y`, and `z` are scaled coordinates.
+    """
+
+    header = las.header
+    x_scale, y_scale, z_scale = header.scale
+    x_offset, y_offset, z_offset = header.offset
+
+    # Point formats 6+ use a full classification byte and 4 bits for return numbers
+    if header.data_format_id >= 6:
+        classification_name = 'classification_byte'
+        class_mask = 0b11111111
+        return_mask = 0b1111
+    else:
+        classification_name = 'raw_classification'
+        class_mask = 0b11111
+        return_mask = 0b111
+    return_bits = 4 if header.data_format_id >= 6 else 3
+
+    # Memory-mapped raw dimensions are only looked up when a requested field
+    # or the filter first needs them
+    sources = {
+        'x': lambda: las.X,
+        'y': lambda: las.Y,
+        'z': lambda: las.Z,
+        'intensity': lambda: las.reader.get_dimension('intensity'),
+        'classification': lambda: las.reader.get_dimension(classification_name),
+        'return_num': lambda: las.reader.get_dimension('flag_byte'),
+        'num_returns': lambda: las.reader.get_dimension('flag_byte')
+    }
+    raw = {}
+
+    def dimension(name):
+        if name not in raw:
+            raw[name] = sources[name]()
+        return raw[name]
+
+    # Functions decoding raw dimensions
+    decode = {
+        'x': lambda a: a * x_scale + x_offset,
+        'y': lambda a: a * y_scale + y_offset,
+        'z': lambda a: a * z_scale + z_offset,
+        'intensity': lambda a: a,
+        'classification': lambda a: a & class_mask,
+        'return_num': lambda a: a & return_mask,
+        'num_returns': lambda a: (a >> return_bits) & return_mask
+    }
+
+    for start in range(0, header.point_records_count, chunk_size):
+        stop = start + chunk_size
+
+        if where is None:
+            yield {f: decode[f](dimension(f)[start:stop]) for f in fields}
+            continue
+
+        decoded = {}
+
+        def get(name):
+            if name not in decoded:
+                decoded[name] = decode[name](dimension(name)[start:stop])
+            return decoded[name]
+
+        mask = np.asarray(where(get), dtype=np.bool_)
+        yield {
+            f: decoded[f][mask] if f in decoded else decode[f](dimension(f)[start:stop][mask])
+            for f in fields}
+
+
+def tile_windows(height, width, tile_size):
+
+    """
+    Split a raster into square tiles.
+
+    Yields
+    ------
+    tuple
+        `(tile_id, window)` where `tile_id` is `row * n_tile_cols + col`.
+    """
+
+    n_tile_cols = -(-width // tile_size)
+    for row_min in range(0, height, tile_size):
+        for col_min in range(0, width, tile_size):
+            tile_id = (row_min // tile_size) * n_tile_cols + col_min // tile_size
+            yield tile_id, ((row_min, min(row_min + tile_size, height)),
+                            (col_min, min(col_min + tile_size, width)))
+
+
+def bucket_points(chunks, transform, height, width, tile_size, halo, directory,
+                  columns=('x', 'y', 'z')):
+
+    """
+    Assign points to every tile whose window, expanded by `halo` pixels,
+    contains them, and spill each tile's points to its own file.  Points near
+    a tile's edge are shared with its neighbors so interpolation is
+    continuous across tile boundaries.  Memory use is bounded by the chunk
+    size rather than the number of points.
+
+    Parameters
+    ----------
+    chunks : iter
+        Dictionaries of arrays.  See `read_chunks()`.
+    transform : affine.Affine
+        Output raster transform.
+    height : int
+        Output rows.
+    width : int
+        Output columns.
+    tile_size : int
+        Tile size in pixels.
+    halo : int
+        Halo width in pixels.  Cannot exceed `tile_size`.
+    directory : str
+        Directory for tile files.
+    columns : tuple, optional
+        Keys from every chunk to store.  Must start with `x` and `y`.
+
+    Returns
+    -------
+    dict
+        Tile IDs from `tile_windows()` and paths to files containing one row
+        of float64 `columns` for every point in the tile.
+    """
+
+    if halo > tile_size:
+        raise ValueError("Halo cannot exceed tile size: %s > %s" % (halo, tile_size))
+
+    inverse = ~transform
+    n_tile_rows = -(-height // tile_size)
+    n_tile_cols = -(-width // tile_size)
+
+    paths = {}
+    for chunk in chunks:
+
+        x, y = chunk['x'], chunk['y']
+        cols = inverse.a * x + inverse.b * y + inverse.c
+        rows = inverse.d * x + inverse.e * y + inverse.f
+
+        # With halo <= tile_size a point lands in at most two tiles per axis
+        row_min = np.floor((rows - halo) / tile_size).astype(np.int64)
+        row_max = np.floor((rows + halo) / tile_size).astype(np.int64)
+        col_min = np.floor((cols - halo) / tile_size).astype(np.int64)
+        col_max = np.floor((cols + halo) / tile_size).astype(np.int64)
+
+        for tile_rows in (row_min, row_max):
+            for tile_cols in (col_min, col_max):
+
+                keep = (tile_rows >= 0) & (tile_rows < n_tile_rows) \
+                    & (tile_cols >= 0) & (tile_cols < n_tile_cols)
+
+                # Don't duplicate points that only span a single tile on an axis
+                if tile_rows is row_max:
+                    keep &= row_max != row_min
+                if tile_cols is col_max:
+                    keep &= col_max != col_min
+
+                tile_ids = tile_rows[keep] * n_tile_cols + tile_cols[keep]
+                points = np.column_stack([chunk[c][keep] for c in columns]).astype(np.float64)
+
+                order = np.argsort(tile_ids, kind='mergesort')
+                tile_ids = tile_ids[order]
+                points = points[order]
+                unique, starts = np.unique(tile_ids, return_index=True)
+                for tile_id, part in zip(unique, np.split(points, starts[1:])):
+                    path = paths.setdefault(
+                        int(tile_id), os.path.join(directory, '%d.bin' % tile_id))
+                    with open(path, 'ab') as f:
+                        part.tofile(f)
+
+    return paths
+
+
+def idw(points, values, xi, yi, nodata, neighbors=12, power=2.0, radius=None, workers=1,
+        batch_size=65536):
+
+    """
+    Inverse distance weighted interpolation from the nearest points.
+
+    Points are indexed once with a KD-tree and cell centers are queried in
+    batches for their `neighbors` nearest points within `radius`.  The
+    neighbors and weights from every query are applied to all value columns
+    so gridding additional attributes does not query the tree again.  The tree
+    releases the GIL while querying so batches are spread across a pool of
+    `workers` threads.  Cells with no point within `radius` are `nodata`
+    rather than being filled from far away points.  A single neighbor is
+    nearest neighbor interpolation with a search radius.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        `(x, y)` rows.
+    values : np.ndarray
+        Values for every point with one column for every band.
+    xi : np.ndarray
+        X coordinate of every column.
+    yi : np.ndarray
+        Y coordinate of every row.
+    nodata : int or float
+        Value for cells without neighbors.
+    neighbors : int, optional
+        Maximum number of points contributing to a cell.
+    power : float, optional
+        Distance weighting exponent.
+    radius : float or None, optional
+        Maximum search distance in georeferenced units.  Unlimited if `None`.
+    workers : int, optional
+        Number of threads querying the tree.
+    batch_size : int, optional
+        Number of cells per query.
+
+    Returns
+    -------
+    np.ndarray
+        3D array with shape `(values.shape[1], len(yi), len(xi))`.
+    """
+
+    tree = scipy.spatial.cKDTree(points)
+    grid_x, grid_y = np.meshgrid(xi, yi)
+    cells = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+    out = np.full((values.shape[1], len(cells)), nodata, dtype=np.float64)
+
+    n_points = len(points)
+    k = min(neighbors, n_points)
+    bound = np.inf if radius is None else radius
+
+    def query(start):
+        stop = start + batch_size
+        distance, idx = tree.query(cells[start:stop], k=k, distance_upper_bound=bound)
+        if k == 1:
+            distance, idx = distance[:, np.newaxis], idx[:, np.newaxis]
+
+        # Missing neighbors have an index of `n_points` and an infinite distance.
+        # Points coincident with a cell center get a very large weight.
+        found = idx < n_points
+        weights = np.where(found, 1 / np.maximum(distance, 1e-12) ** power, 0)
+        neighbor_values = values[np.where(found, idx, 0)]
+
+        total = weights.sum(axis=1)
+        has = total > 0
+        weighted = np.einsum('ck,ckb->bc', weights[has], neighbor_values[has])
+        out[:, start:stop][:, has] = weighted / total[has]
+
+    starts = range(0, len(cells), batch_size)
+    if workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            pool.map(query, starts)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for start in starts:
+            query(start)
+
+    return out.reshape(-1, len(yi), len(xi))
+
+
+class TIN(object):
+
+    """
+    Triangulated irregular network linearly interpolating any number of point
+    attributes to a fixed grid of cell centers.
+
+    The Delaunay triangulation, the triangle containing every cell center,
+    and every cell's barycentric weights are computed once, so gridding an
+    attribute is only a weighted sum of three vertex values per cell.
+    Triangles with an edge longer than `max_edge` are dropped, which leaves
+    voids like water as nodata rather than filling them with long triangles
+    stretched out from shoreline vegetation.
+    """
+
+    def __init__(self, points, xi, yi, max_edge=None):
+
+        """
+        Parameters
+        ----------
+        points : np.ndarray
+            `(x, y)` rows.
+        xi : np.ndarray
+            X coordinate of every column.
+        yi : np.ndarray
+            Y coordinate of every row.
+        max_edge : float or None, optional
+            Maximum triangle edge length in georeferenced units.
+
+        Raises
+        ------
+        RuntimeError
+            If the points cannot be triangulated.
+        """
+
+        self.shape = (len(yi), len(xi))
+        grid_x, grid_y = np.meshgrid(xi, yi)
+        cells = np.column_stack((grid_x.ravel(), grid_y.ravel()))
+
+        triangulation = scipy.spatial.Delaunay(points)
+        simplex = triangulation.find_simplex(cells)
+
+        keep = np.ones(len(triangulation.simplices), dtype=np.bool_)
+        if max_edge is not None:
+            corners = points[triangulation.simplices]
+            edges = corners - np.roll(corners, 1, axis=1)
+            keep = (np.hypot(edges[..., 0], edges[..., 1]) <= max_edge).all(axis=1)
+
+        inside = simplex >= 0
+        inside[inside] = keep[simplex[inside]]
+        simplex = simplex[inside]
+
+        # Barycentric coordinates from the affine transforms cached by Qhull
+        transforms = triangulation.transform[simplex]
+        b = np.einsum('nij,nj->ni', transforms[:, :2], cells[inside] - transforms[:, 2])
+
+        self.inside = inside
+        self.vertices = triangulation.simplices[simplex]
+        self.weights = np.column_stack((b, 1 - b.sum(axis=1)))
+
+    def interpolate(self, values, nodata):
+
+        """
+        Grid an attribute.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            Value for every point used to build the TIN.
+        nodata : int or float
+            Value for cells outside of the TIN.
+
+        Returns
+        -------
+        np.ndarray
+            2D float64 array.
+        """
+
+        out = np.full(self.inside.shape, nodata, dtype=np.float64)
+        out[self.inside] = (values[self.vertices] * self.weights).sum(axis=1)
+        return out.reshape(self.shape)
+
+
+def interpolate_tile(points, window, transform, method, nodata, max_edge=None, **kwargs):
+
+    """
+    Interpolate points to the cell centers of a single window.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        `(x, y, value, ...)` rows with one value column for every band.
+    window : tuple
+        Output window.
+    transform : affine.Affine
+        Output raster transform.
+    method : str
+        `tin`, `idw`, or a `scipy.interpolate.griddata()` method.
+    nodata : int or float
+        Value for cells that cannot be interpolated.
+    max_edge : float or None, optional
+        Maximum triangle edge length for `tin`.  See `TIN()`.
+    kwargs : **kwargs, optional
+        Additional arguments for `idw()`.
+
+    Returns
+    -------
+    np.ndarray
+        3D array with one band for every value column and the first row at
+        the top of the window.
+    """
+
+    ((row_min, row_max), (col_min, col_max)) = window
+    shape = (points.shape[1] - 2, row_max - row_min, col_max - col_min)
+
+    if len(points) == 0:
+        return np.full(shape, nodata, dtype=np.float64)
+
+    xi = transform.c + (np.arange(col_min, col_max) + 0.5) * transform.a
+    yi = transform.f + (np.arange(row_min, row_max) + 0.5) * transform.e
+
+    if method == 'idw':
+        return idw(points[:, :2], points[:, 2:], xi, yi, nodata, **kwargs)
+
+    try:
+        if method == 'tin':
+            tin = TIN(points[:, :2], xi, yi, max_edge=max_edge)
+            return np.array([tin.interpolate(values, nodata) for values in points[:, 2:].T])
+        else:
+            return np.rollaxis(scipy.interpolate.griddata(
+                points=(points[:, 0], points[:, 1]),
+                values=points[:, 2:],
+                xi=(xi[None, :], yi[:, None]),
+                method=method,
+                fill_value=nodata
+            ), 2)
+    # Qhull cannot triangulate fewer than 3 points or collinear points
+    except (RuntimeError, ValueError):
+        return np.full(shape, nodata, dtype=np.float64)
+
+
+def new_grid(shape, dtype, fill=0):
+
+    """
+    Create a grid for an entire raster.  Grids larger than
+    `MAX_IN_MEMORY_BYTES` are backed by an anonymous temporary file with
+    `np.memmap()` so output size is not limited by available memory.
+
+    Parameters
+    ----------
+    shape : tuple
+        Grid shape.
+    dtype : str or np.dtype
+        Pixel type.
+    fill : int or float, optional
+        Initial value.
+
+    Returns
+    -------
+    np.ndarray or np.memmap
+    """
+
+    if int(np.prod(shape)) * np.dtype(dtype).itemsize > MAX_IN_MEMORY_BYTES:
+        out = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=shape)
+        if fill != 0:
+            out[:] = fill
+        return out
+    else:
+        return np.full(shape, fill, dtype=dtype)
+
+
+class CellStatistics(object):
+
+    """
+    Compute per-cell statistics for a point attribute in a single streaming
+    pass over chunks of points.
+
+    Each call to `update()` converts coordinates to cell indexes, reduces the
+    chunk to one partial result per occupied cell with `np.bincount()` and
+    `reduceat()`, and merges it into full grids.  Count, mean, and the sum of
+    squared deviations (M2) are merged with the pairwise algorithm from Chan,
+    Golub, and LeVeque.  Percentiles are approximated from a fixed-range
+    histogram per cell, which costs `rows * cols * bins` counters, so they
+    are only tracked when requested.  Grids are created with `new_grid()`
+    and large ones live on disk rather than in memory.
+    """
+
+    statistics = ('min', 'max', 'mean', 'count', 'std')
+
+    def __init__(self, transform, height, width, value_range=None, bins=64):
+
+        """
+        Parameters
+        ----------
+        transform : affine.Affine
+            Output raster transform.
+        height : int
+            Output rows.
+        width : int
+            Output columns.
+        value_range : tuple or None, optional
+            `(min, max)` attribute range for percentile histograms.
+            Percentiles are not available if `None`.
+        bins : int, optional
+            Number of histogram bins per cell.
+        """
+
+        self.inverse = ~transform
+        self.height = height
+        self.width = width
+        shape = (height, width)
+
+        self.count = new_grid(shape, np.int64)
+        self.mean = new_grid(shape, np.float64)
+        self.m2 = new_grid(shape, np.float64)
+        self.minimum = new_grid(shape, np.float64, fill=np.inf)
+        self.maximum = new_grid(shape, np.float64, fill=-np.inf)
+
+        self.value_range = value_range
+        self.bins = bins
+        self.histogram = None
+        if value_range is not None:
+            self.histogram = new_grid((height * width, bins), np.uint32)
+
+    def update(self, x, y, values):
+
+        """
+        Add a chunk of points.  Points outside of the raster are ignored.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            X coordinates.
+        y : np.ndarray
+            Y coordinates.
+        values : np.ndarray
+            Attribute values.
+        """
+
+        inverse = self.inverse
+        cols = np.floor(inverse.a * x + inverse.b * y + inverse.c).astype(np.int64)
+        rows = np.floor(inverse.d * x + inverse.e * y + inverse.f).astype(np.int64)
+        keep = (rows >= 0) & (rows < self.height) & (cols >= 0) & (cols < self.width)
+        if not keep.any():
+            return
+
+        values = np.asarray(values, dtype=np.float64)[keep]
+        cells, inverted = np.unique(rows[keep] * self.width + cols[keep], return_inverse=True)
+
+        count = np.bincount(inverted)
+        mean = np.bincount(inverted, weights=values) / count
+        deviations = values - mean[inverted]
+        m2 = np.bincount(inverted, weights=deviations * deviations)
+
+        order = np.argsort(inverted, kind='mergesort')
+        starts = np.r_[0, np.cumsum(count)[:-1]]
+        minimum = np.minimum.reduceat(values[order], starts)
+        maximum = np.maximum.reduceat(values[order], starts)
+
+        # Merge with the Chan et al. pairwise update
+        prev_count = self.count.flat[cells]
+        prev_mean = self.mean.flat[cells]
+        n = prev_count + count
+        delta = mean - prev_mean
+        self.m2.flat[cells] += m2 + delta ** 2 * prev_count * count / n
+        self.mean.flat[cells] = prev_mean + delta * count / n
+        self.count.flat[cells] = n
+        self.minimum.flat[cells] = np.minimum(self.minimum.flat[cells], minimum)
+        self.maximum.flat[cells] = np.maximum(self.maximum.flat[cells], maximum)
+
+        if self.histogram is not None:
+            low, high = self.value_range
+            scale = self.bins / float(high - low) if high > low else 0
+            bins = np.clip(((values - low) * scale).astype(np.int64), 0, self.bins - 1)
+            counts = np.bincount(inverted * self.bins + bins, minlength=len(cells) * self.bins)
+            self.histogram[cells] += counts.reshape(len(cells), self.bins).astype(np.uint32)
+
+    def percentile(self, q, strip_cells=65536):
+
+        """
+        Approximate a percentile for every cell by linearly interpolating
+        within the histogram bin containing it.  Cells are processed in
+        strips so only a strip of the histogram is in memory at once.
+
+        Parameters
+        ----------
+        q : float
+            Percentile between 0 and 100.
+        strip_cells : int, optional
+            Number of cells per strip.
+
+        Returns
+        -------
+        np.ndarray
+            2D float64 array.  Cells without points are `NaN`.
+        """
+
+        if self.histogram is None:
+            raise ValueError("Percentiles require a value range")
+
+        low, high = self.value_range
+        width = (high - low) / float(self.bins)
+
+        out = new_grid((self.height * self.width,), np.float64)
+        for start in range(0, len(out), strip_cells):
+            stop = start + strip_cells
+            histogram = np.asarray(self.histogram[start:stop])
+            count = self.count.reshape(-1)[start:stop]
+
+            cumulative = np.cumsum(histogram, axis=1)
+            target = q / 100.0 * count
+            idx = np.argmax(cumulative >= target[:, np.newaxis], axis=1)
+
+            rows = np.arange(len(count))
+            below = cumulative[rows, idx] - histogram[rows, idx]
+            in_bin = histogram[rows, idx]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.where(in_bin > 0, (target - below) / in_bin, 0)
+
+            strip = low + (idx + fraction) * width
+            strip[count == 0] = np.nan
+            out[start:stop] = strip
+
+        return out.reshape(self.height, self.width)
+
+    def results(self, statistic):
+
+        """
+        Get a single statistic.
+
+        Parameters
+        ----------
+        statistic : str
+            A value from `statistics` or `pNN` for the NNth percentile.
+
+        Returns
+        -------
+        np.ndarray
+            2D float64 array.  Cells without points are `NaN` except for
+            `count`.
+        """
+
+        empty = self.count == 0
+        if statistic == 'count':
+            return self.count.astype(np.float64)
+        elif statistic == 'min':
+            out = self.minimum.copy()
+        elif statistic == 'max':
+            out = self.maximum.copy()
+        elif statistic == 'mean':
+            out = self.mean.copy()
+        elif statistic == 'std':
+            out = np.sqrt(self.m2 / np.maximum(self.count, 1))
+        elif statistic.startswith('p'):
+            return self.percentile(float(statistic[1:]))
+        else:
+            raise ValueError("Unrecognized statistic: %s" % statistic)
+        out[empty] = np.nan
+        return out
+
+
+def cb_statistic(ctx, param, value):
+
+    """
+    Click callback to validate ``--stat``.  Percentiles are written as `pNN`,
+    like `p95`.
+    """
+
+    for stat in value:
+        if stat in CellStatistics.statistics:
+            continue
+        try:
+            q = float(stat[1:]) if stat.startswith('p') else None
+        except ValueError:
+            q = None
+        if q is None or not 0 <= q <= 100:
+            raise click.BadParameter(
+                "must be one of %s or a percentile like p95: %s"
+                % (', '.join(CellStatistics.statistics), stat))
+
+    return value
 
 
 @click.command()
@@ -43,25 +847,127 @@ import scipy.interpolate
     help="LiDAR CRS."
 )
 @click.option(
-    '-i', '--interpolation', type=click.Choice(['nearest', 'linear', 'cubic']), default='nearest',
-    help="Interpolation method."
+    '-i', '--interpolation', type=click.Choice(['nearest', 'linear', 'cubic', 'idw', 'tin']),
+    default='nearest', help="Interpolation method."
+)
+@click.option(
+    '--max-edge', type=click.FLOAT, metavar='DISTANCE',
+    help="Drop triangles with an edge longer than this distance with `-i tin'."
+)
+@click.option(
+    '--neighbors', type=click.IntRange(1), default=12, show_default=True,
+    help="Maximum number of points contributing to a cell with `-i idw'."
+)
+@click.option(
+    '--power', type=click.FLOAT, default=2.0, show_default=True,
+    help="Distance weighting exponent for `-i idw'."
+)
+@click.option(
+    '--search-radius', type=click.FLOAT, metavar='DISTANCE',
+    help="Cells with no points within this distance are nodata with `-i idw'.  "
+         "Defaults to unlimited."
+)
+@click.option(
+    '-w', '--workers', type=click.IntRange(1), default=1,
+    help="Number of threads querying points with `-i idw'."
 )
 @click.option(
     '-kr', '--keep-return', type=click.INT, metavar='INT',
-    help="Process points with the specified return number."
+    help="Process points with the specified return number.  Shorthand for "
+         "--filter 'return_num == INT'."
 )
 @click.option(
     '-kc', '--keep-class', type=click.INT, metavar='INT',
-    help="Process points with the specified classification."
+    help="Process points with the specified classification.  Shorthand for "
+         "--filter 'classification == INT'."
+)
+@click.option(
+    '--filter', 'filter_expression', metavar='EXPRESSION',
+    help="Only process points matching an expression like "
+         "`classification in (2, 9) and return_num == 1 and z < 3000'.  Fields: %s."
+         % ', '.join(FIELDS)
+)
+@click.option(
+    '-s', '--stat', 'statistics', metavar='NAME', multiple=True, callback=cb_statistic,
+    help="Bin points into cells and write this statistic as a band instead of "
+         "interpolating.  One of min, max, mean, count, std, or pNN for an approximate "
+         "percentile.  May be specified multiple times."
+)
+@click.option(
+    '-a', '--attribute', 'attributes', multiple=True, default=('z',), show_default=True,
+    type=click.Choice(['z', 'intensity', 'classification', 'return_num']),
+    help="Point attribute to grid.  May be specified multiple times to write one band per "
+         "attribute, or one band per attribute and statistic with --stat."
+)
+@click.option(
+    '--percentile-bins', type=click.IntRange(2), default=64, show_default=True,
+    help="Histogram bins per cell for approximate percentiles."
+)
+@click.option(
+    '--tile-size', type=click.IntRange(1), metavar='PIXELS',
+    help="Interpolate and write square tiles of this size instead of the entire raster at "
+         "once."
+)
+@click.option(
+    '--halo', type=click.IntRange(0), default=16, metavar='PIXELS', show_default=True,
+    help="Points within this many pixels of a tile are included when interpolating it.  "
+         "Only used with --tile-size."
+)
+@click.option(
+    '--chunk-size', type=click.IntRange(1), default=1000000, metavar='POINTS', show_default=True,
+    help="Number of points to read at once.  Only used with --tile-size and --stat."
 )
 def rasterize_z(lidar, raster, target_res, target_size, crs, driver, creation_option, interpolation,
-                keep_class, keep_return):
+                max_edge, neighbors, power, search_radius, workers, keep_class, keep_return,
+                filter_expression, statistics, attributes, percentile_bins, tile_size, halo, chunk_size):
 
     """
     Grid LiDAR into a raster.
 
-    Currently only Z values can be gridded and point filtering could be much
-    more sophisticated but its a proof of concept.
+    Points can be filtered with a `--filter` expression, which is compiled
+    once and evaluated as a single mask for every chunk of points, so
+    coordinates are only gathered once no matter how many conditions there
+    are.  `--keep-class` and `--keep-return` are combined with it:
+    \b
+        $ grid-lidar.py points.laz dtm.tif -crs EPSG:26918 -tr 1 1 -i tin \\
+            --filter 'classification in (2, 9) and return_num == num_returns'
+
+    \b
+    Large point clouds can be gridded out of core with `--tile-size`.  Points
+    are read in chunks and spilled to a temporary file for every output tile,
+    including a halo of points from neighboring tiles so results are
+    continuous across tile edges, and every tile is interpolated and written
+    on its own.  Memory use depends on the tile size rather than the number of
+    points.  Tiles with no points are nodata.
+    \b
+        $ grid-lidar.py points.laz dem.tif -crs EPSG:26918 -tr 1 1 \\
+            -i linear --tile-size 1024 -co TILED=YES
+    \b
+    Inverse distance weighting with `-i idw` uses a KD-tree to find up to
+    `--neighbors` points within `--search-radius` of every cell and leaves
+    cells without any as nodata, so water and other voids are not filled
+    with values stretched from the shoreline.  When combined with
+    `--tile-size` the halo should cover the search radius.
+    \b
+        $ grid-lidar.py points.laz dem.tif -crs EPSG:26918 -tr 1 1 \\
+            -i idw --search-radius 3 --power 2 --workers 4 -kc 2
+    \b
+    `-i tin` triangulates the points once, or once per tile, drops triangles
+    with an edge longer than `--max-edge`, and caches every cell's triangle
+    and barycentric weights.  Every `--attribute` is then gridded into its own
+    band from the same triangulation:
+    \b
+        $ grid-lidar.py points.laz grid.tif -crs EPSG:26918 -tr 1 1 \\
+            -i tin --max-edge 5 -a z -a intensity -a return_num
+    \b
+    Many products only need per-cell aggregation.  `--stat` bins every point
+    into the cell containing it in a single streaming pass and writes one band
+    per statistic.  Percentiles are approximated with a histogram of
+    `--percentile-bins` bins per cell spanning the attribute's range.  Large
+    grids and histograms are kept in temporary files rather than in memory:
+    \b
+        $ grid-lidar.py points.laz dsm.tif -crs EPSG:26918 -tr 1 1 \\
+            --stat max --stat mean --stat count --stat p95 -kr 1
     """
 
     # Validate arguments and convert to pixel space (Y, X)
@@ -75,18 +981,40 @@ def rasterize_z(lidar, raster, target_res, target_size, crs, driver, creation_op
     elif len(target_res) is not 0 and len(target_size) is not 0:
         click.echo("ERROR: Cannot specify target resolution and target size.")
         sys.exit(1)
-        
+    if tile_size is not None and halo > tile_size:
+        click.echo("ERROR: --halo cannot exceed --tile-size.")
+        sys.exit(1)
+
+    conditions = []
+    if filter_expression:
+        conditions.append('(%s)' % filter_expression)
+    if keep_class is not None:
+        conditions.append('classification == %d' % keep_class)
+    if keep_return is not None:
+        conditions.append('return_num == %d' % keep_return)
+    where = None
+    if conditions:
+        try:
+            where = compile_filter(' and '.join(conditions))
+        except ValueError as e:
+            click.echo("ERROR: Invalid --filter: %s" % e)
+            sys.exit(1)
+
     with laspy.file.File(lidar) as las:
 
+        # Header extents avoid reading every point
+        x_min, y_min = las.header.min[:2]
+        x_max, y_max = las.header.max[:2]
+
         if len(target_res) is not 0:
-            n_cols = abs(int((las.x.max() - las.x.min()) / target_res[0]))
-            n_rows = abs(int((las.y.max() - las.y.min()) / target_res[1]))
+            n_cols = abs(int((x_max - x_min) / target_res[0]))
+            n_rows = abs(int((y_max - y_min) / target_res[1]))
         elif len(target_size) is not 0:
-            target_res = (-abs((las.y.max() - las.y.min()) / target_size[0]), abs((las.x.max() - las.x.min()) / target_size[0]))
+            target_res = (-abs((y_max - y_min) / target_size[0]), abs((x_max - x_min) / target_size[0]))
             n_rows, n_cols = target_size
-        geotransform = (las.x.min(), target_res[1], 0, las.y.max(), 0, target_res[0])
+        geotransform = (x_min, target_res[1], 0, y_max, 0, target_res[0])
         meta = {
-            'count': 1,
+            'count': len(attributes) * (len(statistics) or 1),
             'crs': crs,
             'dtype': rasterio.float32,
             'affine': affine.Affine.from_gdal(*geotransform),
@@ -97,40 +1025,80 @@ def rasterize_z(lidar, raster, target_res, target_size, crs, driver, creation_op
             'transform': affine.Affine.from_gdal(*geotransform)
         }
         meta.update({co.split('=')[0]: co.split('=')[1] for co in creation_option})
+        interpolation_options = {}
+        if interpolation == 'idw':
+            interpolation_options = dict(
+                neighbors=neighbors, power=power, radius=search_radius, workers=workers)
+        elif interpolation == 'tin':
+            interpolation_options = dict(max_edge=max_edge)
+
         with rasterio.open(raster, 'w', **meta) as raster:
 
-            X = las.x
-            Y = las.y
-            Z = las.z
-
-            # This could be WAY fancier
-            if keep_class is not None:
-                classification = las.classification
-                X = X[classification == keep_class]
-                Y = Y[classification == keep_class]
-                Z = Z[classification == keep_class]
-            if keep_return is not None:
-                return_num = las.return_num
-                X = X[return_num == keep_return]
-                Y = Y[return_num == keep_return]
-                Z = Z[return_num == keep_return]
-
-            # Ideally the user would have access to a triangulation routine as well but this is the
-            # quick and dirty method.  Triangulation would let the user specify max leg length for
-            # better anti-aliasing and better vegetation representation if it supports finding the nearest
-            # neighbor in 3D instead of just 2D.  Nodata areas are filled so water contains a lot of nonsense
-            # values, which isn't terrible except that they stretch out from shoreline vegetation to create large
-            # elevated triangles.
-            xi = np.linspace(X.min(), X.max(), raster.meta['width'])
-            yi = np.linspace(Y.min(), Y.max(), raster.meta['height'])
-            gridded = scipy.interpolate.griddata(
-                points=(X, Y),
-                values=Z,
-                xi=(xi[None, :], yi[:, None]),
-                method=interpolation,
-                fill_value=raster.meta['nodata'],
-            )[::-1]  # For some reason the entire array is flipped across the the X axis???
-            raster.write_band(1, gridded.astype(raster.meta['dtype']))
+            columns = ('x', 'y') + attributes
+            chunks = read_chunks(las, chunk_size, fields=columns, where=where)
+
+            if statistics:
+
+                cells = {}
+                for attribute in attributes:
+                    if not any(s.startswith('p') for s in statistics):
+                        value_range = None
+                    elif attribute == 'z':
+                        value_range = (las.header.min[2], las.header.max[2])
+                    else:
+                        value_range = ATTRIBUTE_RANGES[attribute]
+                    cells[attribute] = CellStatistics(
+                        raster.affine, raster.height, raster.width, value_range=value_range,
+                        bins=percentile_bins)
+
+                for chunk in chunks:
+                    for attribute in attributes:
+                        cells[attribute].update(chunk['x'], chunk['y'], chunk[attribute])
+
+                bidx = 1
+                for attribute in attributes:
+                    for stat in statistics:
+                        data = cells[attribute].results(stat)
+                        data[np.isnan(data)] = raster.meta['nodata']
+                        raster.write_band(bidx, data.astype(raster.meta['dtype']))
+                        raster.update_tags(bidx, statistic=stat, attribute=attribute)
+                        bidx += 1
+                return
+
+            for bidx, attribute in enumerate(attributes, 1):
+                raster.update_tags(bidx, attribute=attribute)
+
+            if tile_size is not None:
+
+                directory = tempfile.mkdtemp(prefix='grid-lidar-')
+                try:
+                    paths = bucket_points(
+                        chunks, raster.affine, raster.height, raster.width, tile_size, halo,
+                        directory, columns=columns)
+                    tiles = list(tile_windows(raster.height, raster.width, tile_size))
+                    with click.progressbar(tiles) as tiles:
+                        for tile_id, window in tiles:
+                            if tile_id in paths:
+                                points = np.fromfile(paths[tile_id], dtype=np.float64)
+                                points = points.reshape(-1, len(columns))
+                            else:
+                                points = np.empty((0, len(columns)))
+                            gridded = interpolate_tile(
+                                points, window, raster.affine, interpolation, raster.meta['nodata'],
+                                **interpolation_options)
+                            raster.write(gridded.astype(raster.meta['dtype']), window=window)
+                finally:
+                    shutil.rmtree(directory)
+                return
+
+            points = np.concatenate(
+                [np.column_stack([chunk[c] for c in columns]) for chunk in chunks])
+
+            # Grid cell centers the same way as tiles so output does not depend on `--tile-size`
+            gridded = interpolate_tile(
+                points, ((0, raster.height), (0, raster.width)), raster.affine, interpolation,
+                raster.meta['nodata'], **interpolation_options)
+            raster.write(gridded.astype(raster.meta['dtype']))
 
 
 if __name__ == '__main__':
@@ -8,6 +8,10 @@ Compute a density raster for input geometries or sum a property.
 
 from __future__ import division
 
+from collections import deque
+import multiprocessing
+import tempfile
+
 import affine
 import click
 import fiona as fio
@@ -15,8 +19,678 @@ import numpy as np
 import rasterio as rio
 import rasterio.dtypes
 from rasterio.features import rasterize
+from scipy.signal import fftconvolve
+from shapely.geometry import asShape
 import str2type.ext
 
+try:
+    from rasterio.enums import MergeAlg
+except ImportError:  # rasterio < 1.0
+    MergeAlg = None
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+
+# Full raster accumulators larger than this are memory-mapped to a temporary file
+MAX_IN_MEMORY_BYTES = 512 * 1024 ** 2
+
+KERNELS = ('gaussian', 'quartic', 'epanechnikov')
+
+
+def accumulate(data, shapes, transform, all_touched=False):
+
+    """
+    Add `(geometry, value)` pairs into an accumulator array.  Every pixel
+    intersecting a geometry has the geometry's value added to it.
+
+    When available all geometries are burned with a single additive
+    `rasterize()` call writing directly into `data`.  Older versions of
+    rasterio lack `MergeAlg.add` so each geometry is burned into a scratch
+    array that is reused across geometries and then added to `data`.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        2D float64 accumulator array.  Modified in place.
+    shapes : iter
+        `(geometry, value)` pairs.
+    transform : affine.Affine
+        Transform for `data`.
+    all_touched : bool, optional
+        Enable all touched rasterization.
+
+    Returns
+    -------
+    np.ndarray
+        `data`
+    """
+
+    if MergeAlg is not None:
+        shapes = list(shapes)
+        if shapes:
+            rasterize(
+                shapes=shapes,
+                out=data,
+                transform=transform,
+                all_touched=all_touched,
+                merge_alg=MergeAlg.add
+            )
+    else:
+        scratch = np.empty_like(data)
+        for geometry, value in shapes:
+            scratch.fill(0)
+            rasterize(
+                shapes=[(geometry, value)],
+                out=scratch,
+                transform=transform,
+                all_touched=all_touched
+            )
+            data += scratch
+
+    return data
+
+
+def sum_block(shapes, shape, transform, dtype, all_touched=False):
+
+    """
+    Accumulate `(geometry, values)` pairs into a new block and cast to the
+    output type.  Blocks are independent so this is also the unit of work for
+    `--workers`, in which case all arguments must be picklable.
+
+    Parameters
+    ----------
+    shapes : iter
+        `(geometry, values)` pairs with one value per band.  See
+        `feature_values()`.
+    shape : tuple
+        (bands, rows, cols)
+    transform : affine.Affine
+        Transform for the block.
+    dtype : str
+        Output pixel type.
+    all_touched : bool, optional
+        Enable all touched rasterization.
+
+    Returns
+    -------
+    np.ndarray
+    """
+
+    shapes = list(shapes)
+
+    data = np.zeros(shape, dtype=np.float64)
+    for band, out in enumerate(data):
+        accumulate(
+            out, ((g, v[band]) for g, v in shapes if v[band]), transform, all_touched=all_touched)
+
+    return data.astype(dtype)
+
+
+def sum_blocks_parallel(tasks, workers, depth=None):
+
+    """
+    Compute blocks with `sum_block()` on a pool of worker processes while the
+    caller writes previously finished blocks.  Results are produced in the
+    same order as `tasks`, so output is identical to serial processing, and at
+    most `depth` blocks are in flight so features are not read faster than
+    blocks are written.
+
+    Parameters
+    ----------
+    tasks : iter
+        Produces `(payload, args)` where `args` are passed to `sum_block()`.
+    workers : int
+        Number of worker processes.
+    depth : int or None, optional
+        Maximum number of blocks in flight.  Defaults to `workers * 4`.
+
+    Yields
+    ------
+    tuple
+        `(payload, data)` in the same order as `tasks`.
+    """
+
+    depth = depth or workers * 4
+
+    pool = multiprocessing.Pool(workers)
+    pending = deque()
+    try:
+        for payload, args in tasks:
+            pending.append((payload, pool.apply_async(sum_block, args)))
+            if len(pending) > depth:
+                payload, result = pending.popleft()
+                yield payload, result.get()
+        while pending:
+            payload, result = pending.popleft()
+            yield payload, result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def feature_values(feat, properties):
+
+    """
+    Get the values a feature adds to every pixel it intersects, one per band:
+    `1` for a density band, which is represented by `None`, or the value of a
+    property.  Missing property values are treated as `0`.
+    """
+
+    return tuple(1 if name is None else feat['properties'][name] or 0 for name in properties)
+
+
+def delta_sign(feat, delta_field):
+
+    """
+    Get the sign of a feature in an update delta layer: `1` if the feature was
+    added and `-1` if it was removed, according to the `delta_field` property.
+
+    Raises
+    ------
+    click.ClickException
+        If the property is not `add` or `remove`.
+    """
+
+    change = feat['properties'][delta_field]
+    if change == 'add':
+        return 1
+    elif change == 'remove':
+        return -1
+    else:
+        raise click.ClickException("Feature `%s' has an invalid `%s' value: %r - must be "
+                                   "`add' or `remove'" % (feat['id'], delta_field, change))
+
+
+def bucket_features(features, raster, properties=(None,), delta_field=None):
+
+    """
+    Read every feature exactly once and assign it to every output block its
+    bounding box intersects.
+
+    Output blocks form a regular grid so the intersecting blocks are computed
+    directly from the feature's bounds, without a spatial index.  This
+    replaces one spatial query per block, which re-reads and re-parses every
+    feature spanning multiple blocks, and makes inputs without a native
+    spatial index, like GeoJSON, usable.  Each geometry is stored once and
+    shared by all of its blocks, but every intersecting feature is held in
+    memory.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON features.
+    raster : <rasterio RasterUpdater>
+        Output raster supplying the block layout and affine transformation.
+    properties : list, optional
+        Property to sum for every band or `None` for density.  See
+        `feature_values()`.  Defaults to a single density band.
+    delta_field : str or None, optional
+        Negate the values of features removed in an update delta layer.  See
+        `delta_sign()`.
+
+    Returns
+    -------
+    dict
+        Keys are `(row, col)` block indexes like `raster.block_windows()` and
+        values are lists of `(geometry, values)` pairs suitable for
+        `sum_block()`.
+    """
+
+    block_rows, block_cols = raster.block_shapes[0]
+    max_j = (raster.height - 1) // block_rows
+    max_i = (raster.width - 1) // block_cols
+    inverse = ~raster.affine
+
+    buckets = {}
+    for feat in features:
+
+        values = feature_values(feat, properties)
+        if not any(values) or feat['geometry'] is None:
+            continue
+        if delta_field is not None and delta_sign(feat, delta_field) < 0:
+            values = tuple(-v for v in values)
+
+        x_min, y_min, x_max, y_max = asShape(feat['geometry']).bounds
+        col_min, row_min = inverse * (x_min, y_max)
+        col_max, row_max = inverse * (x_max, y_min)
+
+        j_min, j_max = max(int(row_min // block_rows), 0), min(int(row_max // block_rows), max_j)
+        i_min, i_max = max(int(col_min // block_cols), 0), min(int(col_max // block_cols), max_i)
+
+        shape = (feat['geometry'], values)
+        for j in range(j_min, j_max + 1):
+            for i in range(i_min, i_max + 1):
+                buckets.setdefault((j, i), []).append(shape)
+
+    return buckets
+
+
+def update_blocks(features, raster, properties, delta_field, all_touched=False):
+
+    """
+    Apply a delta layer of added and removed features to an existing output
+    raster in place.
+
+    Summation is linear so removing a feature is the same as adding it with
+    negated values.  The delta is bucketed by block, every touched block is
+    read, its delta is accumulated with `sum_block()` and added, and the block
+    is written back.  Untouched blocks are never read or written so the cost
+    depends on the size of the change rather than the size of the dataset.
+    A modified feature is represented by removing the old version and adding
+    the new one.
+
+    Values are read back from the output raster so repeated updates
+    accumulate rounding error when the output type is narrower than float64,
+    and results are only identical to a full rebuild for integer sums.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON features in the delta layer.
+    raster : <rasterio RasterUpdater>
+        Existing output raster opened in `r+` mode.
+    properties : list
+        Property summed into every band or `None` for density.
+    delta_field : str
+        Property indicating whether a feature was added or removed.  See
+        `delta_sign()`.
+    all_touched : bool, optional
+        Enable all touched rasterization.  Must match the original run.
+
+    Returns
+    -------
+    int
+        Number of blocks rewritten.
+    """
+
+    buckets = bucket_features(features, raster, properties=properties, delta_field=delta_field)
+
+    windows = [(ij, w) for ij, w in raster.block_windows() if ij in buckets]
+    with click.progressbar(windows) as bar:
+        for ij, window in bar:
+            ((row_min, row_max), (col_min, col_max)) = window
+            delta = sum_block(
+                buckets.pop(ij), (raster.count, row_max - row_min, col_max - col_min),
+                raster.window_transform(window), np.float64, all_touched=all_touched)
+            data = raster.read(window=window).astype(np.float64) + delta
+            raster.write(data.astype(raster.meta['dtype']), window=window)
+
+    return len(windows)
+
+
+def new_accumulator(shape):
+
+    """
+    Create a zeroed float64 accumulator for an entire raster.  Accumulators
+    larger than `MAX_IN_MEMORY_BYTES` are backed by an anonymous temporary
+    file with `np.memmap()` so output size is not limited by available memory.
+
+    Parameters
+    ----------
+    shape : tuple
+        (bands, rows, cols)
+
+    Returns
+    -------
+    np.ndarray or np.memmap
+    """
+
+    if int(np.prod(shape)) * 8 > MAX_IN_MEMORY_BYTES:
+        return np.memmap(tempfile.TemporaryFile(), dtype=np.float64, mode='w+', shape=shape)
+    else:
+        return np.zeros(shape, dtype=np.float64)
+
+
+def _bin_batch(out, inverse, xs, ys, values):
+
+    """
+    Add a batch of point values, one row per point and one column per band,
+    into `out` with a grouped sum.  See `bin_points()`.
+    """
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(xs), -1)
+
+    cols = np.floor(inverse.a * xs + inverse.b * ys + inverse.c).astype(np.int64)
+    rows = np.floor(inverse.d * xs + inverse.e * ys + inverse.f).astype(np.int64)
+
+    bands, height, width = out.shape
+    keep = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+    # Sum duplicate pixels first so the fancy indexed add below is correct.
+    # Pixel indexes are shared by every band.
+    pixels, inverted = np.unique(rows[keep] * width + cols[keep], return_inverse=True)
+    flat = out.reshape(bands, -1)
+    for band in range(bands):
+        flat[band, pixels] += np.bincount(inverted, weights=values[keep, band])
+
+
+def bin_points(features, out, affine, properties=(None,), batch_size=100000):
+
+    """
+    Compute point density or sum a point property without rasterizing.
+
+    Point coordinates are collected in large batches and converted to pixel
+    indexes with the inverse affine transformation.  Each batch is reduced to
+    one sum per pixel with `np.unique()` and `np.bincount()` and added to the
+    accumulator, so the cost is a few vectorized passes per batch rather than
+    one `rasterize()` call per point.  `MultiPoint` geometries add their value
+    once for every point.  Points outside of the accumulator are ignored.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON point features.
+    out : np.ndarray
+        3D float64 accumulator with one band per property.  See
+        `new_accumulator()`.  Modified in place.
+    affine : affine.Affine
+        Transform for `out`.
+    properties : list, optional
+        Property to sum for every band or `None` for density.  See
+        `feature_values()`.  Defaults to a single density band.
+    batch_size : int, optional
+        Number of points to convert at once.
+
+    Raises
+    ------
+    click.ClickException
+        If a geometry is not a point.
+
+    Returns
+    -------
+    np.ndarray
+        `out`
+    """
+
+    inverse = ~affine
+    xs = []
+    ys = []
+    values = []
+
+    for feat in features:
+
+        value = feature_values(feat, properties)
+        if not any(value) or feat['geometry'] is None:
+            continue
+
+        geometry = feat['geometry']
+        if geometry['type'] == 'Point':
+            coordinates = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPoint':
+            coordinates = geometry['coordinates']
+        else:
+            raise click.ClickException(
+                "Feature `%s' is not a point: %s" % (feat['id'], geometry['type']))
+
+        for c in coordinates:
+            xs.append(c[0])
+            ys.append(c[1])
+            values.append(value)
+
+        if len(xs) >= batch_size:
+            _bin_batch(out, inverse, xs, ys, values)
+            del xs[:], ys[:], values[:]
+
+    if xs:
+        _bin_batch(out, inverse, xs, ys, values)
+
+    return out
+
+
+def kernel_weights(kernel, bandwidth, x_res, y_res):
+
+    """
+    Compute a kernel density weight matrix for a pixel grid.
+
+    The `quartic` and `epanechnikov` kernels reach zero at `bandwidth`.  The
+    `gaussian` kernel uses `bandwidth` as its standard deviation and is
+    truncated at three standard deviations.  Weights are normalized so that
+    they sum to one unit of mass per unit of area, so convolving a grid of
+    point counts produces points per unit of area and the total number of
+    points is preserved.
+
+    Parameters
+    ----------
+    kernel : str
+        See `KERNELS`.
+    bandwidth : float
+        Kernel bandwidth in georeferenced units.
+    x_res : float
+        Pixel width.
+    y_res : float
+        Pixel height.
+
+    Raises
+    ------
+    ValueError
+        If the kernel is not supported.
+
+    Returns
+    -------
+    np.ndarray
+        2D array with an odd number of rows and columns centered on the
+        center pixel.
+    """
+
+    if kernel not in KERNELS:
+        raise ValueError("Unsupported kernel: %s" % kernel)
+
+    radius = bandwidth * 3 if kernel == 'gaussian' else bandwidth
+    x_radius = int(radius // x_res)
+    y_radius = int(radius // y_res)
+
+    xs = np.arange(-x_radius, x_radius + 1) * x_res
+    ys = np.arange(-y_radius, y_radius + 1) * y_res
+    u2 = (xs[np.newaxis, :] ** 2 + ys[:, np.newaxis] ** 2) / bandwidth ** 2
+
+    if kernel == 'gaussian':
+        weights = np.where(u2 <= 9, np.exp(-0.5 * u2), 0)
+    elif kernel == 'quartic':
+        weights = np.where(u2 < 1, (1 - u2) ** 2, 0)
+    else:
+        weights = np.where(u2 < 1, 1 - u2, 0)
+
+    return weights / (weights.sum() * x_res * y_res)
+
+
+def convolve_block(data, kernel, window):
+
+    """
+    Convolve one block of a full raster accumulator with a kernel.
+
+    The block is extracted with a halo as wide as the kernel's radius, which
+    is zero-padded past the edge of the raster, and convolved with an FFT so
+    the cost depends on the block and kernel size rather than the number of
+    points.  Blocks with no data in their halo skip the FFT entirely.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        3D accumulator covering the entire raster.  See `new_accumulator()`.
+    kernel : np.ndarray
+        See `kernel_weights()`.
+    window : tuple
+        Block window.
+
+    Returns
+    -------
+    np.ndarray
+        3D float64 block.
+    """
+
+    ((row_min, row_max), (col_min, col_max)) = window
+    y_radius, x_radius = kernel.shape[0] // 2, kernel.shape[1] // 2
+    bands, height, width = data.shape
+
+    # Halo window in the accumulator's pixel space, clipped to the raster
+    top, left = row_min - y_radius, col_min - x_radius
+    r0, r1 = max(top, 0), min(row_max + y_radius, height)
+    c0, c1 = max(left, 0), min(col_max + x_radius, width)
+
+    padded = np.zeros(
+        (bands, row_max - row_min + 2 * y_radius, col_max - col_min + 2 * x_radius),
+        dtype=np.float64)
+    padded[:, r0 - top:r1 - top, c0 - left:c1 - left] = data[:, r0:r1, c0:c1]
+
+    out = np.zeros((bands, row_max - row_min, col_max - col_min), dtype=np.float64)
+    for band in range(bands):
+        if not padded[band].any():
+            continue
+        out[band] = fftconvolve(padded[band], kernel, mode='valid')
+
+        # FFT round-off leaves tiny non-zero values where there is no data
+        tolerance = np.abs(padded[band]).sum() * kernel.max() * np.finfo(np.float64).eps * 64
+        out[band][np.abs(out[band]) < tolerance] = 0
+
+    return out
+
+
+def _aggregate(data, offset, factor, axis):
+
+    """
+    Sum groups of `factor` pixels along one axis of a block whose first pixel
+    is at `offset` in the full raster.  Groups are aligned to the overview
+    grid rather than the block so partial groups at the block's edges are
+    completed by neighboring blocks.  See `OverviewBuilder()`.
+    """
+
+    first = -offset % factor
+    starts = np.arange(first, data.shape[axis], factor)
+    if first:
+        starts = np.r_[0, starts]
+    return np.add.reduceat(data, starts, axis=axis)
+
+
+class OverviewBuilder(object):
+
+    """
+    Aggregate overview levels from output blocks as they are written so the
+    output does not have to be read again to build them.  Every level is the
+    average of the non-nodata pixels it covers, like GDAL's `average`
+    resampling, and is computed directly from the full resolution blocks.
+    Levels are held in `new_accumulator()` arrays as a sum and a count.
+    """
+
+    def __init__(self, shape, factors, nodata=None):
+
+        """
+        Parameters
+        ----------
+        shape : tuple
+            (bands, rows, cols) of the full resolution raster.
+        factors : list
+            Decimation factors like `[2, 4, 8]`.
+        nodata : int or float or None, optional
+            Pixels with this value are excluded from the average.
+        """
+
+        self.factors = sorted(factors)
+        self.nodata = nodata
+
+        bands, height, width = shape
+        self.sums = []
+        self.counts = []
+        for factor in self.factors:
+            level_shape = (bands, -(-height // factor), -(-width // factor))
+            self.sums.append(new_accumulator(level_shape))
+            self.counts.append(new_accumulator(level_shape))
+
+    def add(self, data, window):
+
+        """
+        Aggregate a block into every overview level.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            3D block exactly as written to the output.
+        window : tuple
+            Block window.
+        """
+
+        ((row_min, row_max), (col_min, col_max)) = window
+
+        data = data.astype(np.float64)
+        if self.nodata is None:
+            valid = np.ones_like(data)
+        elif np.isnan(self.nodata):
+            valid = (~np.isnan(data)).astype(np.float64)
+        else:
+            valid = (data != self.nodata).astype(np.float64)
+        data[valid == 0] = 0
+
+        for factor, sums, counts in zip(self.factors, self.sums, self.counts):
+            r0, c0 = row_min // factor, col_min // factor
+            for arr, out in ((data, sums), (valid, counts)):
+                agg = _aggregate(_aggregate(arr, row_min, factor, 1), col_min, factor, 2)
+                out[:, r0:r0 + agg.shape[1], c0:c0 + agg.shape[2]] += agg
+
+    def levels(self, dtype, strip_rows=256):
+
+        """
+        Compute every overview level in strips of rows so a level is never
+        held in memory at once.
+
+        Parameters
+        ----------
+        dtype : str
+            Output pixel type.  Averages are rounded for integer types.
+        strip_rows : int, optional
+            Number of overview rows in each strip.
+
+        Yields
+        ------
+        tuple
+            `(factor, row_off, data)` from the highest to the lowest
+            resolution and from the top of each level to the bottom.
+        """
+
+        fill = 0 if self.nodata is None else self.nodata
+        for factor, sums, counts in zip(self.factors, self.sums, self.counts):
+            for row_off in range(0, sums.shape[1], strip_rows):
+                rows = slice(row_off, row_off + strip_rows)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    data = np.where(counts[:, rows] > 0, sums[:, rows] / counts[:, rows], fill)
+                if np.issubdtype(np.dtype(dtype), np.integer):
+                    data = np.round(data)
+                yield factor, row_off, data.astype(dtype)
+
+
+def write_overviews(path, builder, dtype):
+
+    """
+    Write levels from an `OverviewBuilder()` into a raster's overviews.
+    GDAL's `NONE` resampling creates the overviews without reading the full
+    resolution data, and the levels are then written directly into them one
+    strip of rows at a time.
+    Requires the GDAL Python bindings.
+
+    Parameters
+    ----------
+    path : str
+        Output raster.  Must not be open.
+    builder : OverviewBuilder
+        Aggregated overview levels.
+    dtype : str
+        Output pixel type.
+    """
+
+    ds = gdal.Open(path, gdal.GA_Update)
+    try:
+        ds.BuildOverviews('NONE', builder.factors)
+        for factor, row_off, data in builder.levels(dtype):
+            idx = builder.factors.index(factor)
+            for band in range(ds.RasterCount):
+                ds.GetRasterBand(band + 1).GetOverview(idx).WriteArray(data[band], 0, row_off)
+    finally:
+        # Closes the dataset and flushes to disk
+        ds = None
+
 
 def cb_res(ctx, param, value):
 
@@ -96,7 +770,7 @@ def cb_bbox(ctx, param, value):
     callback=str2type.ext.click_cb_key_val, help="Output raster creation options."
 )
 @click.option(
-    '-t', '--output-type', type=click.Choice(rio_dtypes.typename_fwd.values()),
+    '-t', '--output-type', type=click.Choice(rasterio.dtypes.typename_fwd.values()),
     metavar='NAME', default='Float32',
     help="Output raster type.  Defaults to `Float32' but must support the value "
          "accessed by --property if it is supplied."
@@ -116,19 +790,59 @@ def cb_bbox(ctx, param, value):
     help="Name of input layer to process."
 )
 @click.option(
-    '-p', '--property', 'property_name', metavar='NAME',
-    help="Property to sum.  Defaults to density."
+    '-p', '--property', 'property_names', metavar='NAME', multiple=True,
+    help="Property to sum.  May be specified multiple times to write one band per "
+         "property.  Defaults to density."
+)
+@click.option(
+    '--density', is_flag=True,
+    help="Add a density band after the --property bands."
 )
 @click.option(
     '-a', '--all-touched', is_flag=True,
-    help="Enable all touched rasterization."
+    help="Enable all touched rasterization.  Only supported by the 'rasterize' engine."
 )
 @click.option(
     '--bbox', metavar='X_MIN Y_MIN X_MAX Y_MAX', nargs=4, callback=cb_bbox,
     help='Only process data within the specified bounding box.'
 )
+@click.option(
+    '-e', '--engine', type=click.Choice(['auto', 'rasterize', 'bin']), default='auto',
+    help="Rasterize geometries block by block or bin points directly into pixels.  "
+         "Default is to bin point layers and rasterize everything else."
+)
+@click.option(
+    '--index-blocks', is_flag=True,
+    help="Read the input once and bucket features by output block in memory instead of "
+         "running a spatial query for every block.  Best for inputs without a spatial "
+         "index, like GeoJSON.  Only supported by the 'rasterize' engine."
+)
+@click.option(
+    '-k', '--kernel', type=click.Choice(KERNELS),
+    help="Compute a kernel density surface for a point layer instead of summing pixels."
+)
+@click.option(
+    '--bandwidth', type=click.FLOAT,
+    help="Kernel bandwidth in georeferenced units.  Required by --kernel."
+)
+@click.option(
+    '--update', 'delta_field', metavar='FIELD',
+    help="Treat INFILE as a delta layer of added and removed features and update the "
+         "existing OUTFILE in place.  FIELD is a property that is either `add' or `remove'."
+)
+@click.option(
+    '--overview', 'overview_factors', metavar='FACTOR', type=click.IntRange(2), multiple=True,
+    help="Build an overview level with this decimation factor while writing.  May be "
+         "specified multiple times.  Requires the GDAL Python bindings."
+)
+@click.option(
+    '-w', '--workers', type=click.IntRange(1), default=1,
+    help="Number of worker processes rasterizing blocks.  Only supported by the "
+         "'rasterize' engine."
+)
 def main(infile, outfile, creation_option, driver_name, output_type, resolution, nodata, layer_name,
-         property_name, all_touched, bbox):
+         property_names, density, all_touched, bbox, engine, index_blocks, kernel, bandwidth,
+         delta_field, overview_factors, workers):
 
     """
     Creation a geometry density map or sum a property.
@@ -182,7 +896,49 @@ def main(infile, outfile, creation_option, driver_name, output_type, resolution,
             --creation-option TILED=YES \\
             --resolution 100 \\
             --property ID
+    \b
+    Every `--property` is written to its own band, in order, and `--density`
+    adds a final density band.  All bands are computed while reading the input
+    once.  Each band's property is stored in a `property` tag.
 
+    \b
+    Point layers are binned directly into pixels rather than rasterized, which
+    is much faster.  Use `--engine rasterize` to force rasterization, which is
+    required by `--all-touched`, `--index-blocks`, and `--workers`.
+    \b
+    Compute a kernel density surface with a 500 meter bandwidth.  Points are
+    binned and then convolved with the kernel block by block, so the cost does
+    not depend on the number of points within the bandwidth.  Output values
+    are per unit of area and properties are used as weights:
+    \b
+        $ summation-raster.py sample-data/point-sample.geojson OUT.tif \\
+            --resolution 10 \\
+            --kernel quartic \\
+            --bandwidth 500
+    \b
+    Apply a delta layer of added and removed features to an existing output
+    without regenerating it.  Only the blocks the delta touches are rewritten
+    and bands are determined by the output's `property` tags, so `--property`,
+    `--density`, and options describing the output are ignored.  The
+    `all_touched` tag recorded by the original run is used when present.
+    Removing a feature subtracts its contribution.  Kernel density outputs
+    cannot be updated because the kernel spreads every point across blocks,
+    and outputs with overviews cannot be updated because only the full
+    resolution blocks are rewritten:
+    \b
+        $ summation-raster.py changes.geojson OUT.tif --update change
+    \b
+    Build average overviews as blocks are written rather than with a second
+    pass like `gdaladdo` that reads the entire output again.  Requires the
+    GDAL Python bindings:
+    \b
+        $ summation-raster.py sample-data/point-sample.geojson OUT.tif \\
+            --resolution 10 \\
+            --overview 2 --overview 4 --overview 8 --overview 16
+    \b
+    Blocks are independent and can be rasterized in parallel with `--workers`.
+    Features are still read by the main process, which also writes every block
+    in order, so output is identical to a serial run.
     \b
     NOTE: Point layers work well but other types are raising the error below. All
           geometry types will work once this is fixed.
@@ -195,13 +951,50 @@ def main(infile, outfile, creation_option, driver_name, output_type, resolution,
 
     with fio.open(infile, layer=layer_name) as src:
 
-        if property_name is not None and src.schema['properties'][property_name].split(':')[0] == 'str':
-            raise click.BadParameter("Property `%s' is an invalid type for summation: `%s'"
-                                     % (property_name, src.schema['properties'][property_name]))
+        if delta_field is not None:
+            if overview_factors:
+                raise click.BadParameter("--overview cannot be combined with --update.")
+            with rio.open(outfile, 'r+') as dst:
+                tags = dst.tags()
+                if 'kernel' in tags:
+                    raise click.ClickException(
+                        "Kernel density outputs cannot be updated in place: %s" % outfile)
+                # Outputs written before `all_touched' was recorded rely on the flag
+                if 'all_touched' in tags:
+                    all_touched = tags['all_touched'] == 'TRUE'
+                # Overviews are not refreshed and would no longer match the data
+                if any(dst.overviews(band) for band in dst.indexes):
+                    raise click.ClickException(
+                        "Outputs with overviews cannot be updated in place - remove them "
+                        "and rebuild them after updating: %s" % outfile)
+                properties = [dst.tags(band).get('property') for band in dst.indexes]
+                if None in properties:
+                    raise click.ClickException(
+                        "Output does not have a `property' tag for every band: %s" % outfile)
+                properties = [None if p == 'DENSITY' else p for p in properties]
+                for name in [delta_field] + [p for p in properties if p is not None]:
+                    if name not in src.schema['properties']:
+                        raise click.BadParameter("Delta layer is missing property `%s'" % name)
+                features = src.filter(bbox=bbox) if bbox else src
+                update_blocks(features, dst, properties, delta_field, all_touched=all_touched)
+            return
+
+        if overview_factors and gdal is None:
+            raise click.BadParameter("--overview requires the GDAL Python bindings.")
+
+        for property_name in property_names:
+            if src.schema['properties'][property_name].split(':')[0] == 'str':
+                raise click.BadParameter("Property `%s' is an invalid type for summation: `%s'"
+                                         % (property_name, src.schema['properties'][property_name]))
+
+        # One entry per band with `None` indicating density
+        properties = list(property_names)
+        if density or not properties:
+            properties.append(None)
 
         v_x_min, v_y_min, v_x_max, v_y_max = src.bounds if not bbox else bbox
         raster_meta = {
-            'count': 1,
+            'count': len(properties),
             'crs': src.crs,
             'driver': driver_name,
             'dtype': output_type,
@@ -213,38 +1006,100 @@ def main(infile, outfile, creation_option, driver_name, output_type, resolution,
         raster_meta['transform'] = raster_meta['affine']
         raster_meta.update(**creation_option)
 
+        if engine == 'auto':
+            engine = 'bin' if 'Point' in src.schema['geometry'] else 'rasterize'
+
+        if engine != 'rasterize':
+            rasterize_options = (
+                ('--all-touched', all_touched),
+                ('--index-blocks', index_blocks),
+                ('--workers', workers > 1))
+            for name, value in rasterize_options:
+                if value:
+                    raise click.BadParameter(
+                        "%s is only supported by the 'rasterize' engine." % name)
+
+        if kernel is not None:
+            if bandwidth is None or bandwidth <= 0:
+                raise click.BadParameter("--kernel requires a positive --bandwidth.")
+            if engine != 'bin':
+                raise click.BadParameter("--kernel requires a point layer and the 'bin' engine.")
+            weights = kernel_weights(kernel, bandwidth, x_res, y_res)
+
         with rio.open(outfile, 'w', **raster_meta) as dst:
 
             num_blocks = len([bw for bw in dst.block_windows()])
-            with click.progressbar(dst.block_windows(), length=num_blocks) as block_windows:
-                for _, window in block_windows:
 
-                    ((row_min, row_max), (col_min, col_max)) = window
-                    x_min, y_min = dst.affine * (col_min, row_max)
-                    x_max, y_max = dst.affine * (col_max, row_min)
+            for band, property_name in enumerate(properties, 1):
+                dst.update_tags(band, property=property_name or 'DENSITY')
+
+            # Describes how the output was computed for `--update`
+            dst.update_tags(all_touched='TRUE' if all_touched else 'FALSE')
+            if kernel is not None:
+                dst.update_tags(kernel=kernel, bandwidth=repr(bandwidth))
+
+            if engine == 'bin':
+                accumulator = new_accumulator((dst.count, dst.height, dst.width))
+                features = src.filter(bbox=bbox) if bbox else src
+                bin_points(features, accumulator, dst.affine, properties=properties)
+
+                def bin_blocks():
+                    for _, window in dst.block_windows():
+                        ((row_min, row_max), (col_min, col_max)) = window
+                        if kernel is not None:
+                            data = convolve_block(accumulator, weights, window)
+                        else:
+                            data = accumulator[:, row_min:row_max, col_min:col_max]
+                        yield window, data.astype(dst.meta['dtype'])
+
+                blocks = bin_blocks()
+
+            else:
+                if index_blocks:
+                    buckets = bucket_features(
+                        src.filter(bbox=bbox) if bbox else src, dst, properties=properties)
 
-                    block_affine = dst.window_transform(window)
+                def block_tasks():
+                    for ij, window in dst.block_windows():
 
-                    data = np.zeros((row_max - row_min, col_max - col_min), dtype=dst.meta['dtype'])
+                        ((row_min, row_max), (col_min, col_max)) = window
+                        x_min, y_min = dst.affine * (col_min, row_max)
+                        x_max, y_max = dst.affine * (col_max, row_min)
 
-                    for feat in src.filter(bbox=(x_min, y_min, x_max, y_max)):
-                        if property_name is None:
-                            add_val = 1
+                        if index_blocks:
+                            shapes = buckets.pop(ij, [])
                         else:
-                            add_val = feat['properties'][property_name]
-                            if add_val is None:
-                                add_val = 0
-
-                        data += rasterize(
-                            shapes=[feat['geometry']],
-                            out_shape=data.shape,
-                            fill=dst.nodata,
-                            transform=block_affine,
-                            all_touched=all_touched,
-                            default_value=add_val,
-                            dtype=rio.float64
-                        ).astype(dst.meta['dtype'])
-                    dst.write(data.astype(dst.meta['dtype']), indexes=1, window=window)
+                            # Adding zero is a no-op so don't bother burning
+                            shapes = (
+                                (feat['geometry'], feature_values(feat, properties))
+                                for feat in src.filter(bbox=(x_min, y_min, x_max, y_max)))
+                            shapes = ((g, v) for g, v in shapes if any(v))
+                            if workers > 1:
+                                shapes = list(shapes)
+
+                        yield window, (shapes, (dst.count, row_max - row_min, col_max - col_min),
+                                       dst.window_transform(window), dst.meta['dtype'], all_touched)
+
+                if workers > 1:
+                    blocks = sum_blocks_parallel(block_tasks(), workers)
+                else:
+                    blocks = ((window, sum_block(*args)) for window, args in block_tasks())
+
+            overviews = None
+            if overview_factors:
+                overviews = OverviewBuilder(
+                    (dst.count, dst.height, dst.width), overview_factors, nodata=dst.nodata)
+
+            with click.progressbar(blocks, length=num_blocks) as blocks:
+                for window, data in blocks:
+                    dst.write(data, window=window)
+                    if overviews is not None:
+                        overviews.add(data, window)
+
+            dtype = dst.meta['dtype']
+
+        if overviews is not None:
+            write_overviews(outfile, overviews, dtype)
 
 
 if __name__ == '__main__':
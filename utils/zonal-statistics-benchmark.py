@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+
+
+"""
+Benchmark `zonal-statistics.py` against synthetic rasters and polygon layers.
+See main() docstring for more info.
+"""
+
+
+from __future__ import division
+
+from collections import OrderedDict
+import json
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+
+import affine
+import click
+import fiona as fio
+import numpy as np
+import rasterio as rio
+from shapely.geometry import mapping
+from shapely.geometry import Point
+
+
+ZONAL_STATS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'zonal-statistics.py')
+
+CRS = {'init': 'epsg:32618'}
+
+# Raster and vector parameters for every scenario.  `block` is the tile size
+# or `None` for a strip encoded raster.  Polygon radii are drawn from a
+# lognormal distribution with `sigma` and scaled so that on average every
+# pixel is covered by `overlap` polygons.
+SCENARIOS = OrderedDict([
+    ('small-uncompressed', {
+        'width': 2048, 'height': 2048, 'count': 1, 'dtype': 'uint8', 'block': 256,
+        'compress': None, 'features': 500, 'sigma': 0.5, 'overlap': 1.0
+    }),
+    ('naip-deflate', {
+        'width': 4096, 'height': 4096, 'count': 4, 'dtype': 'uint8', 'block': 256,
+        'compress': 'deflate', 'features': 2000, 'sigma': 0.75, 'overlap': 3.0
+    }),
+    ('dem-striped-lzw', {
+        'width': 4096, 'height': 4096, 'count': 1, 'dtype': 'float32', 'block': None,
+        'compress': 'lzw', 'features': 2000, 'sigma': 0.75, 'overlap': 1.0
+    }),
+    ('many-small-features', {
+        'width': 4096, 'height': 4096, 'count': 1, 'dtype': 'uint16', 'block': 512,
+        'compress': 'deflate', 'features': 50000, 'sigma': 0.25, 'overlap': 0.5
+    }),
+    ('few-large-features', {
+        'width': 8192, 'height': 8192, 'count': 1, 'dtype': 'uint8', 'block': 512,
+        'compress': 'deflate', 'features': 10, 'sigma': 1.0, 'overlap': 1.0
+    }),
+])
+
+# Keyword arguments for `zonal_stats_from_raster()`
+MODES = OrderedDict([
+    ('default', {}),
+    ('coalesce-blocks', {'coalesce_blocks': True}),
+    ('prefetch', {'prefetch': 4}),
+    ('max-window-pixels', {'max_window_pixels': 2 ** 20}),
+])
+
+
+def write_raster(path, width, height, count, dtype, block, compress, seed=0, **kwargs):
+
+    """
+    Write a synthetic GeoTIFF filled with random values one block at a time.
+
+    Parameters
+    ----------
+    path : str
+        Output file.
+    width : int
+        Number of columns.
+    height : int
+        Number of rows.
+    count : int
+        Number of bands.
+    dtype : str
+        Pixel type.
+    block : int or None
+        Tile size in pixels or `None` for strips.
+    compress : str or None
+        GeoTIFF compression.
+    seed : int, optional
+        Random seed.
+    kwargs : **kwargs, optional
+        Ignored.  Allows passing a scenario directly.
+    """
+
+    meta = {
+        'driver': 'GTiff',
+        'width': width,
+        'height': height,
+        'count': count,
+        'dtype': dtype,
+        'crs': CRS,
+        'affine': affine.Affine(1.0, 0.0, 0.0, 0.0, -1.0, float(height)),
+        'nodata': 0
+    }
+    meta['transform'] = meta['affine']
+    if block is not None:
+        meta.update(tiled=True, blockxsize=block, blockysize=block)
+    if compress is not None:
+        meta['compress'] = compress
+
+    random = np.random.RandomState(seed)
+    info = np.iinfo(dtype) if np.dtype(dtype).kind in 'iu' else None
+
+    with rio.open(path, 'w', **meta) as dst:
+        for _, window in dst.block_windows():
+            ((row_min, row_max), (col_min, col_max)) = window
+            shape = (count, row_max - row_min, col_max - col_min)
+            if info is not None:
+                data = random.randint(1, min(info.max, 1000), size=shape).astype(dtype)
+            else:
+                data = random.uniform(1, 1000, size=shape).astype(dtype)
+            dst.write(data, window=window)
+
+
+def write_polygons(path, width, height, features, sigma, overlap, seed=0, **kwargs):
+
+    """
+    Write a synthetic layer of circular polygons scattered across a raster
+    produced by `write_raster()`.
+
+    Parameters
+    ----------
+    path : str
+        Output GeoJSON file.
+    width : int
+        Raster width.
+    height : int
+        Raster height.
+    features : int
+        Number of polygons.
+    sigma : float
+        Standard deviation of the lognormal radius distribution.  Larger values
+        produce a mix of very small and very large polygons.
+    overlap : float
+        Average number of polygons covering each pixel.
+    seed : int, optional
+        Random seed.
+    kwargs : **kwargs, optional
+        Ignored.  Allows passing a scenario directly.
+    """
+
+    random = np.random.RandomState(seed)
+
+    # Scale radii so the expected total area is `overlap` times the raster area
+    radii = random.lognormal(sigma=sigma, size=features)
+    radii *= math.sqrt(overlap * width * height / (math.pi * (radii ** 2).sum()))
+    x_centers = random.uniform(0, width, features)
+    y_centers = random.uniform(0, height, features)
+
+    schema = {'geometry': 'Polygon', 'properties': {'id': 'int'}}
+    with fio.open(path, 'w', driver='GeoJSON', crs=CRS, schema=schema) as dst:
+        for idx, (x, y, r) in enumerate(zip(x_centers, y_centers, radii)):
+            dst.write({
+                'type': 'Feature',
+                'properties': {'id': idx},
+                'geometry': mapping(Point(x, y).buffer(max(r, 1)))
+            })
+
+
+def peak_rss():
+
+    """
+    Get the current process's peak resident set size in bytes.
+
+    On Linux `ru_maxrss` survives `exec()`, so even a spawned worker reports
+    at least its parent's peak.  `VmHWM` from `/proc/self/status` belongs to
+    the process's own address space and is used instead when available.
+    """
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    # Linux reports kilobytes and OS X reports bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    return max_rss
+
+
+def _run(task):
+
+    """
+    Time a single scenario and mode inside of a freshly spawned worker process
+    so the peak RSS measurement is not polluted by previous runs or the
+    parent.  See `peak_rss()`.
+    """
+
+    raster_path, vector_path, kwargs = task
+
+    zonal = runpy.run_path(ZONAL_STATS)
+
+    with fio.drivers(), rio.drivers():
+        with rio.open(raster_path) as src_r, fio.open(vector_path) as src_v:
+
+            # Count pixels up front so it does not count against the timing
+            pixels = 0
+            for _, geometry in zonal['reproject_features'](src_v, src_v.crs, src_r.crs):
+                ((row_min, row_max), (col_min, col_max)) = zonal['feature_window'](src_r, geometry)
+                pixels += (row_max - row_min) * (col_max - col_min) * src_r.count
+
+            start = time.time()
+            n_features = 0
+            for _ in zonal['iter_zonal_stats'](src_v, src_r, **kwargs):
+                n_features += 1
+            elapsed = time.time() - start
+
+    return {
+        'seconds': elapsed,
+        'features': n_features,
+        'pixels': pixels,
+        'features_per_second': n_features / elapsed if elapsed else None,
+        'pixels_per_second': pixels / elapsed if elapsed else None,
+        'peak_rss_bytes': peak_rss()
+    }
+
+
+def compare(results, baseline, threshold):
+
+    """
+    Compare `pixels_per_second` between two benchmark runs.
+
+    Parameters
+    ----------
+    results : dict
+        Current benchmark output.
+    baseline : dict
+        Previous benchmark output.
+    threshold : float
+        Fractional slowdown considered a regression.
+
+    Returns
+    -------
+    list
+        `(scenario, mode, ratio)` for every regression.  A ratio of `0.8`
+        means the current run is 20% slower.
+    """
+
+    previous = {(r['scenario'], r['mode']): r for r in baseline['results']}
+
+    regressions = []
+    for result in results['results']:
+        key = (result['scenario'], result['mode'])
+        if key not in previous or not previous[key]['pixels_per_second']:
+            continue
+        ratio = result['pixels_per_second'] / previous[key]['pixels_per_second']
+        click.echo("%s %s: %.2fx" % (key[0], key[1], ratio), err=True)
+        if ratio < 1 - threshold:
+            regressions.append((key[0], key[1], ratio))
+
+    return regressions
+
+
+@click.command()
+@click.option(
+    '-s', '--scenario', 'scenario_names', multiple=True, type=click.Choice(list(SCENARIOS)),
+    help="Scenario to run.  May be specified multiple times.  Default is all."
+)
+@click.option(
+    '-m', '--mode', 'mode_names', multiple=True, type=click.Choice(list(MODES)),
+    help="Zonal statistics mode to run.  May be specified multiple times.  Default is all."
+)
+@click.option(
+    '-o', '--output', type=click.File('w'), default='-',
+    help="Write JSON results to this file.  Defaults to stdout."
+)
+@click.option(
+    '--compare', 'baseline', type=click.File('r'),
+    help="JSON results from a previous run.  Exits non-zero if any run is slower than "
+         "--threshold."
+)
+@click.option(
+    '--threshold', type=click.FLOAT, default=0.1, show_default=True,
+    help="Fractional slowdown considered a regression."
+)
+@click.option(
+    '--keep', 'keep_dir', type=click.Path(file_okay=False),
+    help="Write and keep synthetic data in this directory instead of a temporary directory."
+)
+def main(scenario_names, mode_names, output, baseline, threshold, keep_dir):
+
+    """
+    Benchmark zonal-statistics.py against synthetic data.
+
+    Every scenario generates a tiled or striped GeoTIFF and a layer of circular
+    polygons with a configurable size distribution and overlap, then times
+    `iter_zonal_stats()` in every mode.  Each run happens in a fresh process
+    and reports features/sec, pixels/sec, where pixels are the number of
+    pixels in every feature's window across all bands, and peak RSS.
+
+    \b
+    Run everything and save the results:
+    \b
+        $ utils/zonal-statistics-benchmark.py -o before.json
+    \b
+    Check a change for regressions:
+    \b
+        $ utils/zonal-statistics-benchmark.py -s naip-deflate \\
+            -o after.json --compare before.json
+    """
+
+    scenario_names = scenario_names or list(SCENARIOS)
+    mode_names = mode_names or list(MODES)
+
+    if keep_dir:
+        if not os.path.exists(keep_dir):
+            os.makedirs(keep_dir)
+        data_dir = keep_dir
+    else:
+        data_dir = tempfile.mkdtemp(prefix='zonal-statistics-benchmark-')
+
+    results = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'rasterio': rio.__version__,
+        'fiona': fio.__version__,
+        'timestamp': time.time(),
+        'results': []
+    }
+
+    # Forked workers inherit the parent's peak RSS so they are spawned instead
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('spawn')
+    else:  # Python 2 can only fork
+        context = multiprocessing
+
+    try:
+        for name in scenario_names:
+            scenario = SCENARIOS[name]
+            raster_path = os.path.join(data_dir, name + '.tif')
+            vector_path = os.path.join(data_dir, name + '.geojson')
+
+            if not os.path.exists(raster_path):
+                click.echo("Generating %s ..." % raster_path, err=True)
+                write_raster(raster_path, **scenario)
+            if not os.path.exists(vector_path):
+                click.echo("Generating %s ..." % vector_path, err=True)
+                write_polygons(vector_path, **scenario)
+
+            for mode in mode_names:
+                click.echo("Running %s %s ..." % (name, mode), err=True)
+                pool = context.Pool(1)
+                try:
+                    result = pool.apply(_run, ((raster_path, vector_path, MODES[mode]),))
+                finally:
+                    pool.close()
+                    pool.join()
+                result.update(scenario=name, mode=mode, parameters=scenario)
+                results['results'].append(result)
+
+    finally:
+        if not keep_dir:
+            shutil.rmtree(data_dir)
+
+    output.write(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+    if baseline is not None:
+        regressions = compare(results, json.load(baseline), threshold)
+        for scenario, mode, ratio in regressions:
+            click.echo("REGRESSION: %s %s is %.0f%% slower" % (scenario, mode, (1 - ratio) * 100),
+                       err=True)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,15 +7,31 @@ band in a raster datasource.
 """
 
 
+from collections import Counter
+from collections import deque
+from collections import OrderedDict
+import hashlib
+import json
+import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
 import pprint
+import sqlite3
+import threading
+import time
 import warnings
 
+from affine import Affine
 import click
 import fiona as fio
+from fiona.transform import transform
 from fiona.transform import transform_geom
 import numpy as np
 import rasterio as rio
+from rasterio.crs import is_geographic_crs
 from rasterio.features import rasterize
+from rtree.index import Index
 from shapely.geometry import asShape
 
 
@@ -48,37 +64,710 @@ def cb_bands(ctx, param, value):
         return sorted([int(i) for i in value.split(',')])
 
 
-def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custom=None):
+def _flatten_coordinates(coordinates, xs, ys):
+
+    """
+    Append every X and Y in a GeoJSON `coordinates` array, of any nesting
+    depth, to `xs` and `ys`.
+    """
+
+    if isinstance(coordinates[0], (int, float)):
+        xs.append(coordinates[0])
+        ys.append(coordinates[1])
+    else:
+        for c in coordinates:
+            _flatten_coordinates(c, xs, ys)
+
+
+def _rebuild_coordinates(coordinates, points):
+
+    """
+    Rebuild a GeoJSON `coordinates` array with the same nesting as
+    `coordinates` by consuming `(x, y)` pairs from the `points` iterator.
+    """
+
+    if isinstance(coordinates[0], (int, float)):
+        return next(points)
+    else:
+        return [_rebuild_coordinates(c, points) for c in coordinates]
+
+
+def _geometry_parts(geometry):
+
+    """
+    Get every geometry with a `coordinates` member, descending into
+    `GeometryCollection`'s.
+    """
+
+    if geometry['type'] == 'GeometryCollection':
+        return [p for g in geometry['geometries'] for p in _geometry_parts(g)]
+    else:
+        return [geometry]
+
+
+def _rebuild_geometry(geometry, points):
+
+    """
+    Inverse of `_geometry_parts()` + `_flatten_coordinates()`.
+    """
+
+    if geometry['type'] == 'GeometryCollection':
+        return {
+            'type': 'GeometryCollection',
+            'geometries': [_rebuild_geometry(g, points) for g in geometry['geometries']]
+        }
+    elif not geometry['coordinates']:
+        return {'type': geometry['type'], 'coordinates': geometry['coordinates']}
+    else:
+        return {
+            'type': geometry['type'],
+            'coordinates': _rebuild_coordinates(geometry['coordinates'], points)
+        }
+
+
+def reproject_features(features, src_crs, dst_crs, batch_size=1000):
+
+    """
+    Reproject feature geometries in batches rather than one at a time.
+
+    `transform_geom()` parses both CRS definitions and builds a new
+    transformer for every call, which dominates the runtime for layers
+    containing many small features.  Instead the coordinates for `batch_size`
+    features are gathered into flat arrays and reprojected with a single call
+    to `transform()`, which builds the transformer once, and the geometries
+    are then rebuilt from the results.  When the CRS's are identical no
+    transformation is performed at all.
+
+    Reprojecting the individual coordinates does not perform antimeridian
+    cutting so when `dst_crs` is geographic any reprojected geometry wider
+    than 180 degrees is reprojected again with
+    `transform_geom(antimeridian_cutting=True)`.
+
+    Parameters
+    ----------
+    features : iter
+        GeoJSON features.
+    src_crs : dict
+        CRS of the input features.
+    dst_crs : dict
+        Target CRS.
+    batch_size : int, optional
+        Number of features to reproject with each call.
+
+    Yields
+    ------
+    tuple
+        `(feature, geometry)` where `feature` is the unmodified input feature
+        and `geometry` is a shapely geometry in `dst_crs`.
+    """
+
+    if src_crs == dst_crs:
+        for feature in features:
+            yield feature, asShape(feature['geometry'])
+        return
+
+    geographic = is_geographic_crs(dst_crs)
+
+    batch = []
+    for feature in features:
+        batch.append(feature)
+        if len(batch) == batch_size:
+            for item in _reproject_batch(batch, src_crs, dst_crs, geographic):
+                yield item
+            batch = []
+
+    for item in _reproject_batch(batch, src_crs, dst_crs, geographic):
+        yield item
+
+
+def _reproject_batch(features, src_crs, dst_crs, geographic):
+
+    """
+    Reproject a list of features with a single call to `transform()`.  See
+    `reproject_features()`.
+    """
+
+    xs = []
+    ys = []
+    for feature in features:
+        for part in _geometry_parts(feature['geometry']):
+            if part['coordinates']:
+                _flatten_coordinates(part['coordinates'], xs, ys)
+
+    if xs:
+        xs, ys = transform(src_crs, dst_crs, xs, ys)
+    points = iter(zip(xs, ys))
+
+    for feature in features:
+        reproj_geom = asShape(_rebuild_geometry(feature['geometry'], points))
+        if geographic and not reproj_geom.is_empty:
+            x_min, _, x_max, _ = reproj_geom.bounds
+            if x_max - x_min > 180:
+                reproj_geom = asShape(transform_geom(
+                    src_crs, dst_crs, feature['geometry'], antimeridian_cutting=True))
+        yield feature, reproj_geom
+
+
+def feature_window(raster, geometry):
+
+    """
+    Compute the pixel aligned window that completely contains a geometry's
+    bounding box.  The window is snapped outward to whole pixels so the data
+    and the rasterized geometry share the same grid and may extend beyond the
+    raster's extent, which is why reads must be boundless.
+
+    Parameters
+    ----------
+    raster : <rasterio RasterReader>
+        Raster datasource supplying the affine transformation.
+    geometry : <shapely geometry>
+        Geometry in the raster's CRS.
+
+    Returns
+    -------
+    tuple
+        ((row_min, row_max), (col_min, col_max))
+    """
+
+    x_min, y_min, x_max, y_max = geometry.bounds
+    col_min, row_max = ~raster.affine * (x_min, y_min)
+    col_max, row_min = ~raster.affine * (x_max, y_max)
+
+    row_min = int(math.floor(row_min))
+    col_min = int(math.floor(col_min))
+
+    # Points and geometries sitting exactly on a pixel edge still need one pixel
+    row_max = max(int(math.ceil(row_max)), row_min + 1)
+    col_max = max(int(math.ceil(col_max)), col_min + 1)
+
+    return (row_min, row_max), (col_min, col_max)
+
+
+def split_window(raster, window, max_pixels):
+
+    """
+    Split a window into sub-windows aligned to the raster's blocks that each
+    contain at most `max_pixels` pixels, unless a single block is larger.  Only
+    the portion of the window intersecting the raster is covered because
+    everything else would be masked anyway.
+
+    Tiles are grown by whole blocks, first across the window and then down,
+    so strip encoded rasters are read a full strip at a time.
+
+    Parameters
+    ----------
+    raster : <rasterio RasterReader>
+        Raster datasource supplying the block layout.
+    window : tuple
+        ((row_min, row_max), (col_min, col_max))
+    max_pixels : int
+        Pixel budget for each sub-window.
+
+    Returns
+    -------
+    list
+        Sub-windows in row-major order.  Empty if the window does not
+        intersect the raster.
+    """
+
+    (row_min, row_max), (col_min, col_max) = window
+    row_min, row_max = max(row_min, 0), min(row_max, raster.height)
+    col_min, col_max = max(col_min, 0), min(col_max, raster.width)
+
+    if row_min >= row_max or col_min >= col_max:
+        return []
+
+    block_rows, block_cols = raster.block_shapes[0]
+    blocks_per_tile = max(1, max_pixels // (block_rows * block_cols))
+
+    # Number of block columns the window actually touches given its alignment
+    spanned_block_cols = (col_max - 1) // block_cols - col_min // block_cols + 1
+    tile_block_cols = max(1, min(blocks_per_tile, spanned_block_cols))
+    tile_block_rows = max(1, blocks_per_tile // tile_block_cols)
+    tile_rows = tile_block_rows * block_rows
+    tile_cols = tile_block_cols * block_cols
+
+    return [
+        ((max(r, row_min), min(r + tile_rows, row_max)), (max(c, col_min), min(c + tile_cols, col_max)))
+        for r in range(row_min // tile_rows * tile_rows, row_max, tile_rows)
+        for c in range(col_min // tile_cols * tile_cols, col_max, tile_cols)
+    ]
+
+
+def overview_factor(raster, geometry, factors, min_pixels):
+
+    """
+    Pick the coarsest overview level that still places at least `min_pixels`
+    pixels inside a geometry.  The number of pixels is estimated from the
+    geometry's area so points and lines always use full resolution.
+
+    Parameters
+    ----------
+    raster : <rasterio RasterReader>
+        Raster datasource.
+    geometry : <shapely geometry>
+        Geometry in the raster's CRS.
+    factors : list
+        Decimation factors from `raster.overviews()`.
+    min_pixels : int
+        Minimum number of pixels that must fall inside the geometry.
+
+    Returns
+    -------
+    int
+        Decimation factor or `1` for full resolution.
+    """
+
+    pixels = geometry.area / abs(raster.affine.a * raster.affine.e)
+    for factor in sorted(factors, reverse=True):
+        if pixels / factor ** 2 >= min_pixels:
+            return factor
+    return 1
+
+
+def decimate_window(raster, window, factor):
+
+    """
+    Clip a window to the raster, snap it to the overview's pixel grid, and
+    compute the output shape for reading it at `1 / factor` resolution.
+    GDAL satisfies decimated reads from the matching overview level.  Pixels
+    outside of the raster would be masked anyway and boundless reads cannot be
+    decimated.
+
+    Parameters
+    ----------
+    raster : <rasterio RasterReader>
+        Raster datasource.
+    window : tuple
+        ((row_min, row_max), (col_min, col_max))
+    factor : int
+        Decimation factor.
+
+    Returns
+    -------
+    tuple or None
+        `(window, (rows, cols))` or `None` if the window does not intersect
+        the raster.
+    """
+
+    (row_min, row_max), (col_min, col_max) = window
+    row_min, row_max = max(row_min, 0), min(row_max, raster.height)
+    col_min, col_max = max(col_min, 0), min(col_max, raster.width)
+
+    if row_min >= row_max or col_min >= col_max:
+        return None
+
+    # Snap to the overview's grid so every output pixel is one overview pixel
+    row_min = row_min // factor * factor
+    col_min = col_min // factor * factor
+    row_max = min(int(math.ceil(row_max / float(factor))) * factor, raster.height)
+    col_max = min(int(math.ceil(col_max / float(factor))) * factor, raster.width)
+
+    out_shape = (
+        int(math.ceil((row_max - row_min) / float(factor))),
+        int(math.ceil((col_max - col_min) / float(factor))))
+
+    return ((row_min, row_max), (col_min, col_max)), out_shape
+
+
+def read_window(raster, bands, window, out_shape=None, boundless=True):
+
+    """
+    Boundless masked read of several bands.  Pixels outside of the raster are
+    masked.  Decimated reads are not boundless, see `decimate_window()`.
+    Every masked read goes through here so the workaround for rasterio's
+    unmasked reads lives in one place.
+
+    Parameters
+    ----------
+    raster : <rasterio RasterReader>
+        Raster datasource.
+    bands : list
+        Band indexes to read.
+    window : tuple
+        ((row_min, row_max), (col_min, col_max))
+    out_shape : tuple or None, optional
+        Read at a reduced resolution with this `(rows, cols)` shape.
+    boundless : bool, optional
+        Set to `False` for windows known to be inside of the raster, like
+        block windows, to skip the overhead of a boundless read.
+
+    Returns
+    -------
+    np.ma.MaskedArray
+        3D array with shape `(len(bands), rows, cols)`.
+    """
+
+    if out_shape is None and boundless:
+        data = raster.read(indexes=bands, window=window, boundless=True, masked=True)
+    elif out_shape is None:
+        data = raster.read(indexes=bands, window=window, masked=True)
+    else:
+        data = raster.read(
+            indexes=bands, window=window, out_shape=(len(bands),) + tuple(out_shape), masked=True)
+
+    # This should be a masked array, but a bug requires us to build our own:
+    # https://github.com/mapbox/rasterio/issues/338
+    if not isinstance(data, np.ma.MaskedArray):
+        data = np.ma.array(data, mask=data == raster.nodata)
+
+    return data
+
+
+def read_ahead(path, bands, tasks, depth):
+
+    """
+    Read windows on a pool of background threads while the caller processes
+    previously read windows.  GDAL releases the GIL while reading and
+    decompressing so the next `depth` windows are read while NumPy reduces the
+    current one.  Dataset handles are not thread safe so every thread opens
+    its own.
+
+    Parameters
+    ----------
+    path : str
+        Path to the raster datasource.
+    bands : list
+        Band indexes to read.
+    tasks : iter
+        Produces `(payload, window, out_shape)`.  See `read_window()`.  A
+        window of `None` is passed through without a read.
+    depth : int
+        Maximum number of reads in flight ahead of the caller.
+
+    Yields
+    ------
+    tuple
+        `(payload, data)` in the same order as `tasks`.  See `read_window()`.
+    """
+
+    local = threading.local()
+    handles = []
+    lock = threading.Lock()
+
+    def read(window, out_shape):
+        if window is None:
+            return None
+        if not hasattr(local, 'raster'):
+            local.raster = rio.open(path)
+            with lock:
+                handles.append(local.raster)
+        return read_window(local.raster, bands, window, out_shape)
+
+    pool = ThreadPool(depth)
+    pending = deque()
+    try:
+        for payload, window, out_shape in tasks:
+            pending.append((payload, pool.apply_async(read, (window, out_shape))))
+            if len(pending) > depth:
+                payload, result = pending.popleft()
+                yield payload, result.get()
+        while pending:
+            payload, result = pending.popleft()
+            yield payload, result.get()
+    finally:
+        pool.terminate()
+        pool.join()
+        for raster in handles:
+            raster.close()
+
+
+class BlockCache(object):
+
+    """
+    Serve arbitrary boundless windows from a raster while reading and
+    decompressing every intersecting block exactly once.
+
+    Every window that will be requested must first be announced with
+    `register()`, which increments a reference count for every block the
+    window touches.  Blocks are read on first access for all requested bands
+    and are held in memory until the final window referencing them has been
+    passed to `release()`.  When windows are processed in block order only the
+    current "frontier" of blocks is held in memory.
+    """
+
+    def __init__(self, raster, bands):
+
+        """
+        Parameters
+        ----------
+        raster : <rasterio RasterReader>
+            Raster datasource.
+        bands : list
+            Band indexes to read from every block.
+        """
+
+        self.raster = raster
+        self.bands = bands
+        self.block_rows, self.block_cols = raster.block_shapes[0]
+        self.block_windows = dict(raster.block_windows())
+        self.refcount = Counter()
+        self._blocks = {}
+
+    def blocks(self, window):
+
+        """
+        Get the `(row, col)` index of every block intersecting a window.
+
+        Parameters
+        ----------
+        window : tuple
+            ((row_min, row_max), (col_min, col_max))
+
+        Returns
+        -------
+        list
+            Block indexes in row-major order.  Empty if the window is completely
+            outside of the raster.
+        """
+
+        (row_min, row_max), (col_min, col_max) = window
+        row_min, row_max = max(row_min, 0), min(row_max, self.raster.height)
+        col_min, col_max = max(col_min, 0), min(col_max, self.raster.width)
+
+        if row_min >= row_max or col_min >= col_max:
+            return []
+
+        return [
+            (j, i)
+            for j in range(row_min // self.block_rows, (row_max - 1) // self.block_rows + 1)
+            for i in range(col_min // self.block_cols, (col_max - 1) // self.block_cols + 1)
+        ]
+
+    def register(self, window):
+
+        """
+        Announce that a window will be read.
+        """
+
+        self.refcount.update(self.blocks(window))
+
+    def release(self, window):
+
+        """
+        Announce that a window is no longer needed and drop all blocks that
+        are no longer referenced by a registered window.
+        """
+
+        for ij in self.blocks(window):
+            self.refcount[ij] -= 1
+            if self.refcount[ij] <= 0:
+                del self.refcount[ij]
+                self._blocks.pop(ij, None)
+
+    def _block(self, ij):
+
+        """
+        Get a 3D masked array containing all bands for a single block, reading
+        it from the raster if it is not already in memory.
+        """
+
+        if ij not in self._blocks:
+            self._blocks[ij] = read_window(
+                self.raster, self.bands, self.block_windows[ij], boundless=False)
+
+        return self._blocks[ij]
+
+    def read(self, window):
+
+        """
+        Equivalent to a boundless masked read of all bands but served from
+        in-memory blocks.  Pixels outside of the raster are masked.
+
+        Parameters
+        ----------
+        window : tuple
+            ((row_min, row_max), (col_min, col_max))
+
+        Returns
+        -------
+        np.ma.MaskedArray
+            3D array with shape `(len(bands), rows, cols)`.
+        """
+
+        (row_min, row_max), (col_min, col_max) = window
+        out = np.ma.array(
+            np.zeros(
+                (len(self.bands), row_max - row_min, col_max - col_min),
+                dtype=self.raster.dtypes[self.bands[0] - 1]),
+            mask=True)
+
+        for ij in self.blocks(window):
+            (b_row_min, b_row_max), (b_col_min, b_col_max) = self.block_windows[ij]
+            data = self._block(ij)
+
+            # Intersection of the block and the window in raster pixel space
+            r0, r1 = max(row_min, b_row_min), min(row_max, b_row_max)
+            c0, c1 = max(col_min, b_col_min), min(col_max, b_col_max)
+
+            out[:, r0 - row_min:r1 - row_min, c0 - col_min:c1 - col_min] = \
+                data[:, r0 - b_row_min:r1 - b_row_min, c0 - b_col_min:c1 - b_col_min]
+
+        return out
+
+
+class MetricAccumulator(object):
+
+    """
+    Compute min, max, mean, standard deviation, and sum for every band of a 3D
+    masked array in a single fused pass and merge partial results.
+
+    Each call to `update()` gathers the valid pixels for every band once and
+    computes the count, sum, min, max, and the sum of squared deviations from
+    the mean (M2) of that chunk.  Chunks are combined with the pairwise
+    algorithm from Chan, Golub, and LeVeque, which keeps the variance
+    numerically stable even for large counts and values far from zero, and
+    allows accumulators built from different windows, or in different
+    processes, to be merged with `merge()`.
+    """
+
+    metrics = ('min', 'max', 'mean', 'std', 'sum')
+
+    def __init__(self, n_bands):
+
+        """
+        Parameters
+        ----------
+        n_bands : int
+            Number of bands in every array passed to `update()`.
+        """
+
+        self.count = [0] * n_bands
+        self.total = [0.0] * n_bands
+        self.mean = [0.0] * n_bands
+        self.m2 = [0.0] * n_bands
+        self.minimum = [None] * n_bands
+        self.maximum = [None] * n_bands
+
+    def _combine(self, i, count, total, mean, m2, minimum, maximum):
+
+        """
+        Merge the partial state for a single band into this accumulator.
+        """
+
+        if count == 0:
+            return
+        elif self.count[i] == 0:
+            self.count[i], self.total[i], self.mean[i], self.m2[i] = count, total, mean, m2
+            self.minimum[i], self.maximum[i] = minimum, maximum
+            return
+
+        n = self.count[i] + count
+        delta = mean - self.mean[i]
+        self.m2[i] += m2 + delta ** 2 * self.count[i] * count / n
+        self.mean[i] += delta * count / n
+        self.count[i] = n
+        self.total[i] += total
+        self.minimum[i] = min(self.minimum[i], minimum)
+        self.maximum[i] = max(self.maximum[i], maximum)
+
+    def update(self, data):
+
+        """
+        Add the valid pixels from a chunk of data.
+
+        Parameters
+        ----------
+        data : np.ma.MaskedArray
+            3D array with shape `(n_bands, rows, cols)`.  Masked pixels are
+            ignored.
+        """
+
+        valid = ~np.ma.getmaskarray(data)
+        for i in range(len(self.count)):
+            values = data.data[i][valid[i]]
+            if values.size == 0:
+                continue
+            total = values.sum(dtype=np.float64)
+            mean = total / values.size
+            deviations = values - mean
+            self._combine(
+                i, values.size, total, mean, np.dot(deviations, deviations),
+                values.min(), values.max())
+
+    def merge(self, other):
+
+        """
+        Merge another accumulator's state into this one.
+
+        Parameters
+        ----------
+        other : MetricAccumulator
+            Must track the same number of bands.
+        """
+
+        for i in range(len(self.count)):
+            self._combine(
+                i, other.count[i], other.total[i], other.mean[i], other.m2[i],
+                other.minimum[i], other.maximum[i])
+
+    def results(self):
+
+        """
+        Get the final metrics.
+
+        Returns
+        -------
+        list
+            One `{'min': ..., 'max': ..., 'mean': ..., 'std': ..., 'sum': ...}`
+            dictionary per band.  Metrics are `None` if no valid pixels were
+            seen.
+        """
+
+        out = []
+        for i, count in enumerate(self.count):
+            if count == 0:
+                out.append(dict.fromkeys(self.metrics))
+            else:
+                out.append({
+                    'min': self.minimum[i],
+                    'max': self.maximum[i],
+                    'mean': self.mean[i],
+                    'std': np.sqrt(self.m2[i] / count),
+                    'sum': self.total[i]
+                })
+        return out
+
+
+def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custom=None,
+                            coalesce_blocks=False, vector_crs=None, max_window_pixels=None,
+                            prefetch=0, approximate=None):
 
     """
     Compute zonal statistics for each input feature across all bands of an input
     raster.  God help ye who supply large non-block encoded rasters or large
-    polygons...
+    polygons without setting `max_window_pixels`...
 
     By default min, max, mean, standard deviation and sum are computed but the
     user can also create their own functions to compute custom metrics across
-    the intersecting area for every feature and every band.  Functions must
-    accept a 2D masked array extracted from a single band.  Should probably
-    be changed to allow the user to compute statistics across all bands.
+    the intersecting area for every feature and every band.  All requested
+    bands are read with a single call and the built-in metrics are computed
+    together by a `MetricAccumulator`.  Custom functions receive the same 3D
+    masked array with shape `(len(bands), rows, cols)` and must return a
+    sequence containing one value per band, in band order.
 
     Use `custom={'my_metric': my_metric_func}` to call `my_metric_func` on the
     intersecting pixels.  A key named `my_metric` will be added alongside `min`,
-    `max`, etc.  Metrics can also be disabled by doing `custom={'min': None}`
-    to turn off the call to `min`.  The `min` key will still be included in the
-    output but will have a value of `None`.
+    `max`, etc.  Built-in metrics can be replaced with a custom function or
+    disabled by doing `custom={'min': None}`.  The `min` key will still be
+    included in the output but will have a value of `None`.  Built-in metrics
+    are also `None` when a feature does not intersect any valid pixels.
 
     While this function will work with any geometry type the input is intended
     to be polygons.  The goal of this function is to be able to take large
     rasters and a large number of not too giant polygons and be pretty confident
     that nothing is going to break.  There are better methods for collecting
     statistics if the goal is speed or by optimizing for each datatype. Point
-    layers will work but are not as efficient and should be used with rasterio's
-    `sample()` method, and an initial pass to index points against the raster's
-    blocks.
+    layers will work but are not as efficient as `zonal_stats_from_points()`,
+    which indexes points against the raster's blocks and samples each block
+    only once.
 
-    Further optimization could be performed to limit raster I/O for really
-    really large numbers of overlapping polygons but that is outside the
-    intended scope.
+    Large numbers of overlapping polygons repeatedly read and decompress the
+    same raster blocks.  Use `coalesce_blocks=True` to first collect every
+    feature, sort them by the raster blocks they touch, and serve all features
+    from a `BlockCache` that reads each block exactly once.  Every reprojected
+    geometry is held in memory in this mode and features are processed in
+    block order rather than datasource order.
 
     In order to handle raster larger than available memory and vector datasets
     containing a large number of features, the minimum bounding box for each
@@ -87,6 +776,29 @@ def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custo
     the values that intersect the feature.  Metrics are then computed against
     this masked array.
 
+    A single very large polygon can produce a window that does not fit in
+    memory.  Set `max_window_pixels` to split any window containing more pixels
+    into sub-windows aligned to the raster's blocks.  Each sub-window is read,
+    rasterized, and added to the feature's `MetricAccumulator` before the next
+    is read, so peak memory is bounded by the budget regardless of the size of
+    the polygon.  Custom metrics require every pixel at once and cannot be used
+    in this mode.
+
+    On compressed or network mounted rasters the CPU sits idle while a window
+    is read and the disk sits idle while metrics are computed.  Set `prefetch`
+    to read that many windows ahead on background threads with
+    `read_ahead()`.  Not supported with `coalesce_blocks=True`, which already
+    avoids most reads.
+
+    Dashboards and other previews rarely need full resolution stats.  Set
+    `approximate` to the minimum number of pixels that must fall inside each
+    feature and every feature is read from the coarsest overview level that
+    still satisfies it, according to the feature's area.  `sum` is scaled by
+    the number of full resolution pixels each decimated pixel represents and a
+    `resolution` key containing the `(x, y)` pixel size actually used is added
+    alongside `bands`.  Features are never split with `max_window_pixels` when
+    read from an overview.  Not supported with `coalesce_blocks=True`.
+
     Example output:
 
         The outer keys are feature ID's
@@ -129,6 +841,22 @@ def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custo
         Supply custom functions as `{'name': func}`.
     bands : int or list or None, optional
         Bands to compute stats against.  Default is all.
+    all_touched : bool, optional
+        Enable 'all-touched' rasterization.
+    coalesce_blocks : bool, optional
+        Read each raster block only once.  See above.
+    vector_crs : dict or None, optional
+        CRS of the input features.  Defaults to `vector.crs`, but can be used
+        to pass any iterable of GeoJSON features as `vector`.
+    max_window_pixels : int or None, optional
+        Split windows containing more pixels than this into block aligned
+        sub-windows.  See above.
+    prefetch : int, optional
+        Number of windows to read ahead on background threads.  Disabled by
+        default.
+    approximate : int or None, optional
+        Read each feature from the coarsest overview level that places at least
+        this many pixels inside the feature.  See above.
 
     Returns
     -------
@@ -136,6 +864,29 @@ def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custo
         See 'Example output' above.
     """
 
+    return dict(iter_zonal_stats(
+        vector, raster, bands=bands, all_touched=all_touched, custom=custom,
+        coalesce_blocks=coalesce_blocks, vector_crs=vector_crs,
+        max_window_pixels=max_window_pixels, prefetch=prefetch, approximate=approximate))
+
+
+def iter_zonal_stats(vector, raster, bands=None, all_touched=False, custom=None,
+                     coalesce_blocks=False, vector_crs=None, max_window_pixels=None, prefetch=0,
+                     approximate=None):
+
+    """
+    Generator version of `zonal_stats_from_raster()` that yields each
+    feature's stats as soon as they are computed instead of collecting
+    everything in memory.  Takes the same arguments.
+
+    Yields
+    ------
+    tuple
+        `(feature_id, stats)` where `stats` is identical to the values from
+        `zonal_stats_from_raster()`.  Features are yielded in datasource
+        order, or in block order when `coalesce_blocks=True`.
+    """
+
     if bands is None:
         bands = list(range(1, raster.count + 1))
     elif isinstance(bands, int):
@@ -143,13 +894,7 @@ def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custo
     else:
         bands = sorted(bands)
 
-    metrics = {
-        'min': lambda x: x.min(),
-        'max': lambda x: x.max(),
-        'mean': lambda x: x.mean(),
-        'std': lambda x: x.std(),
-        'sum': lambda x: x.sum()
-    }
+    metrics = dict.fromkeys(MetricAccumulator.metrics)
 
     if custom is not None:
         metrics.update(**custom)
@@ -160,17 +905,87 @@ def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custo
             raise click.ClickException(
                 "Custom function `%s' is not callable: %s" % (name, func))
 
+    # Custom metrics need every pixel at once and cannot be merged across sub-windows
+    if max_window_pixels is not None and any(f is not None for f in (custom or {}).values()):
+        raise click.ClickException("Custom metrics cannot be combined with `max_window_pixels'.")
+
+    if prefetch and coalesce_blocks:
+        raise click.ClickException("Cannot combine `prefetch' and `coalesce_blocks'.")
+    if approximate is not None and coalesce_blocks:
+        raise click.ClickException("Cannot combine `approximate' and `coalesce_blocks'.")
+
+    if vector_crs is None:
+        vector_crs = vector.crs
+
     r_x_min, r_y_min, r_x_max, r_y_max = raster.bounds
 
-    feature_stats = {}
-    for feature in vector:
+    def prepare(features):
+        for feature, reproj_geom in reproject_features(features, vector_crs, raster.crs):
+            x_min, y_min, x_max, y_max = reproj_geom.bounds
+            contained = (r_x_min <= x_min <= x_max <= r_x_max) and (r_y_min <= y_min <= y_max <= r_y_max)
+            yield feature['id'], reproj_geom, contained, feature_window(raster, reproj_geom)
 
-        """
-        rasterize(
-            shapes,
-            out_shape=None,
-            fill=0,
-            out=None,
+    if coalesce_blocks:
+        cache = BlockCache(raster, bands)
+        prepared = sorted(prepare(vector), key=lambda f: cache.blocks(f[3])[:1])
+    else:
+        cache = None
+        prepared = prepare(vector)
+
+    def subwindows(window):
+        (row_min, row_max), (col_min, col_max) = window
+        if max_window_pixels is None or (row_max - row_min) * (col_max - col_min) <= max_window_pixels:
+            return [window]
+        else:
+            return split_window(raster, window, max_window_pixels)
+
+    if coalesce_blocks:
+        for _, _, _, window in prepared:
+            for sub_window in subwindows(window):
+                cache.register(sub_window)
+
+    if approximate is not None:
+        factors = sorted(raster.overviews(bands[0]), reverse=True)
+
+    # Flatten features into (feature, sub-window) pairs so reads can be issued
+    # ahead of processing.  A sub-window of `None` marks a feature that does
+    # not intersect the raster.  Approximate reads carry a decimated output
+    # shape.
+    def tasks():
+        for feature in prepared:
+            reads = None
+            if approximate is not None:
+                factor = overview_factor(raster, feature[1], factors, approximate)
+                decimated = decimate_window(raster, feature[3], factor) if factor > 1 else None
+                # Features outside of the raster have no decimated window and
+                # fall back to the same masked boundless reads as other features
+                if decimated is not None:
+                    reads = [decimated]
+            if reads is None:
+                reads = [(sub_window, None) for sub_window in subwindows(feature[3])]
+            reads = reads or [(None, None)]
+            for idx, (sub_window, out_shape) in enumerate(reads):
+                yield (feature, sub_window, out_shape, idx == len(reads) - 1), sub_window, out_shape
+
+    if cache is not None:
+        reads = ((task, cache.read(window) if window else None) for task, window, _ in tasks())
+    elif prefetch:
+        reads = read_ahead(raster.name, bands, tasks(), prefetch)
+    else:
+        reads = ((task, read_window(raster, bands, window, out_shape) if window else None)
+                 for task, window, out_shape in tasks())
+
+    accumulator = MetricAccumulator(len(bands))
+    resolution = abs(raster.affine.a), abs(raster.affine.e)
+    scale = 1.0
+    for ((fid, reproj_geom, contained, _), sub_window, out_shape, last), data in reads:
+
+        """
+        rasterize(
+            shapes,
+            out_shape=None,
+            fill=0,
+            out=None,
             output=None,
             transform=Affine(1.0, 0.0, 0.0, 0.0, 1.0, 0.0),
             all_touched=False,
@@ -179,51 +994,746 @@ def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custo
         )
         """
 
-        stats = {'bands': {}}
+        if sub_window is not None:
+
+            ((row_min, row_max), (col_min, col_max)) = sub_window
+            sub_transform = raster.window_transform(sub_window)
+
+            # Decimated reads cover the same area with fewer, larger pixels
+            if out_shape is not None:
+                row_scale = (row_max - row_min) / float(out_shape[0])
+                col_scale = (col_max - col_min) / float(out_shape[1])
+                sub_transform *= Affine.scale(col_scale, row_scale)
+                resolution = abs(sub_transform.a), abs(sub_transform.e)
+                scale = row_scale * col_scale
+            else:
+                out_shape = (row_max - row_min, col_max - col_min)
+
+            rasterized = rasterize(
+                shapes=[reproj_geom],
+                out_shape=out_shape,
+                fill=1,
+                transform=sub_transform,
+                all_touched=all_touched,
+                default_value=0,
+                dtype=rio.ubyte
+            ).astype(np.bool)
+
+            if cache is not None:
+                cache.release(sub_window)
+
+            data = np.ma.array(data.data, mask=np.ma.getmaskarray(data) | rasterized)
+            accumulator.update(data)
+
+        if not last:
+            continue
+
+        stats = {'bands': {}, 'contained': contained}
+        builtin = accumulator.results()
+
+        # Every decimated pixel stands in for `scale` full resolution pixels
+        if scale != 1.0:
+            for band in builtin:
+                if band['sum'] is not None:
+                    band['sum'] *= scale
+
+        computed = {}
+        for name, func in metrics.items():
+            if func is not None:
+                computed[name] = func(data)
+            elif custom is None or name not in custom:
+                computed[name] = [b[name] for b in builtin]
+            else:
+                computed[name] = [None] * len(bands)
+
+        for i, bidx in enumerate(bands):
+            stats['bands'][bidx] = {name: values[i] for name, values in computed.items()}
+
+        if approximate is not None:
+            stats['resolution'] = resolution
+
+        accumulator = MetricAccumulator(len(bands))
+        resolution = abs(raster.affine.a), abs(raster.affine.e)
+        scale = 1.0
+
+        yield fid, stats
+
+
+def fid_sort_key(fid):
+
+    """
+    Sort key placing integer-like feature ID's in numerical order.  Fiona
+    returns ID's as strings so `'10'` would otherwise sort before `'2'`.
+    """
+
+    try:
+        return 0, int(fid)
+    except (TypeError, ValueError):
+        return 1, str(fid)
+
+
+def partition_features(vector, raster, chunk_size, fids=None):
+
+    """
+    Split the features in a vector datasource into spatially coherent chunks
+    so that each chunk touches as few raster blocks as possible.
+
+    The center of every feature's bounding box is reprojected into the raster's
+    CRS with a single batched call and features are ordered by the block row
+    they fall in and then by X.  This ordering is sliced into chunks of
+    `chunk_size` features, which produces strips of neighboring features that
+    share raster blocks.
+
+    Parameters
+    ----------
+    vector : <fiona feature collection>
+        Vector datasource.
+    raster : <rasterio RasterReader>
+        Raster datasource.
+    chunk_size : int
+        Number of features per chunk.
+    fids : iter or None, optional
+        Only partition features with these ID's.  Default is all.
+
+    Returns
+    -------
+    list
+        A list of lists containing feature ID's.
+    """
+
+    subset = set(fids) if fids is not None else None
+
+    fids = []
+    x_centers = []
+    y_centers = []
+    for feature in vector:
+        if subset is not None and feature['id'] not in subset:
+            continue
+        x_min, y_min, x_max, y_max = asShape(feature['geometry']).bounds
+        fids.append(feature['id'])
+        x_centers.append((x_min + x_max) / 2.0)
+        y_centers.append((y_min + y_max) / 2.0)
+
+    if not fids:
+        return []
+
+    if vector.crs != raster.crs:
+        x_centers, y_centers = transform(vector.crs, raster.crs, x_centers, y_centers)
+    block_rows = raster.block_shapes[0][0]
+    max_block_row = int(math.ceil(raster.height / float(block_rows))) - 1
+
+    keyed = []
+    for fid, x, y in zip(fids, x_centers, y_centers):
+        _, row = ~raster.affine * (x, y)
+        block_row = min(max(int(row // block_rows), 0), max_block_row)
+        keyed.append((block_row, x, fid_sort_key(fid), fid))
+    keyed.sort()
+
+    return [[k[-1] for k in keyed[i:i + chunk_size]] for i in range(0, len(keyed), chunk_size)]
+
+
+def _zonal_stats_worker(task):
+
+    """
+    Compute zonal statistics for a single chunk of features inside of a worker
+    process.  Every worker opens its own datasource handles and fetches its
+    features by ID.  See `zonal_stats_parallel()`.
+    """
+
+    raster_path, vector_path, fids, kwargs = task
+
+    with fio.drivers(), rio.drivers():
+        with rio.open(raster_path) as src_r, fio.open(vector_path) as src_v:
+            features = (src_v[int(fid)] for fid in fids)
+            return zonal_stats_from_raster(features, src_r, vector_crs=src_v.crs, **kwargs)
+
+
+def zonal_stats_parallel(vector_path, raster_path, workers, chunk_size=None, fids=None, **kwargs):
+
+    """
+    Compute zonal statistics with a pool of worker processes.  See
+    `iter_zonal_stats_parallel()` for more information.
+
+    Parameters
+    ----------
+    vector_path : str
+        Path to the vector datasource.
+    raster_path : str
+        Path to the raster datasource.
+    workers : int
+        Number of worker processes.
+    chunk_size : int or None, optional
+        Number of features per task.  Defaults to roughly 4 tasks per worker.
+    fids : iter or None, optional
+        Only process features with these ID's.  Default is all.
+    kwargs : **kwargs, optional
+        Additional keyword arguments for `zonal_stats_from_raster()`.
+
+    Returns
+    -------
+    OrderedDict
+        See `zonal_stats_from_raster()`.  Keys are in feature ID order
+        regardless of which worker finished first.
+    """
+
+    feature_stats = dict(iter_zonal_stats_parallel(
+        vector_path, raster_path, workers, chunk_size=chunk_size, fids=fids, **kwargs))
+
+    return OrderedDict(
+        (fid, feature_stats[fid]) for fid in sorted(feature_stats, key=fid_sort_key))
+
+
+def iter_zonal_stats_parallel(vector_path, raster_path, workers, chunk_size=None, fids=None,
+                              **kwargs):
+
+    """
+    Compute zonal statistics with a pool of worker processes and yield results
+    as chunks finish.
+
+    The vector datasource is read once in the parent process and split into
+    spatially coherent chunks with `partition_features()`.  Each chunk is sent
+    to a worker as a list of feature ID's, the worker opens its own raster and
+    vector handles, and computes stats with `zonal_stats_from_raster()`.
+    Grouping neighboring features keeps each worker's raster reads local,
+    which works well with `coalesce_blocks=True`.
+
+    Features are fetched from the vector datasource by their integer ID and
+    custom metric functions must be picklable, so no lambdas.
+
+    Parameters
+    ----------
+    vector_path : str
+        Path to the vector datasource.
+    raster_path : str
+        Path to the raster datasource.
+    workers : int
+        Number of worker processes.
+    chunk_size : int or None, optional
+        Number of features per task.  Defaults to roughly 4 tasks per worker.
+    fids : iter or None, optional
+        Only process features with these ID's.  Default is all.
+    kwargs : **kwargs, optional
+        Additional keyword arguments for `zonal_stats_from_raster()`.
+
+    Yields
+    ------
+    tuple
+        `(feature_id, stats)` in feature ID order, like serial processing,
+        regardless of which worker finished first.  Results that finish
+        ahead of a lower feature ID are buffered until it arrives, so memory
+        depends on how closely spatial partitions follow ID order.
+    """
+
+    if fids is not None:
+        fids = list(fids)
+
+    with rio.open(raster_path) as src_r, fio.open(vector_path) as src_v:
+        if chunk_size is None:
+            n_features = len(src_v) if fids is None else len(fids)
+            chunk_size = max(1, int(math.ceil(n_features / float(workers * 4))))
+        chunks = partition_features(src_v, src_r, chunk_size, fids=fids)
+
+    tasks = ((raster_path, vector_path, fids, kwargs) for fids in chunks)
+    expected = deque(sorted((fid for chunk in chunks for fid in chunk), key=fid_sort_key))
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        buffered = {}
+        for result in pool.imap_unordered(_zonal_stats_worker, tasks):
+            buffered.update(result)
+            while expected and expected[0] in buffered:
+                fid = expected.popleft()
+                yield fid, buffered.pop(fid)
+
+        # Only reached if a worker did not return a requested feature
+        for fid in sorted(buffered, key=fid_sort_key):
+            yield fid, buffered[fid]
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def zonal_stats_from_points(vector, raster, bands=None, vector_crs=None):
+
+    """
+    Dict returning version of `iter_zonal_stats_from_points()`.
+    """
+
+    return dict(iter_zonal_stats_from_points(
+        vector, raster, bands=bands, vector_crs=vector_crs))
+
+
+def iter_zonal_stats_from_points(vector, raster, bands=None, vector_crs=None):
+
+    """
+    Sample a raster at every point in a vector datasource without rasterizing.
+
+    All point coordinates are collected, reprojected with a single batched
+    call, and converted to row/col with the inverse affine transformation as
+    NumPy arrays.  Points are then bucketed by the raster block they fall in,
+    each block containing at least one point is read exactly once for all
+    bands, and the values are gathered with fancy indexing.
+
+    The output matches `zonal_stats_from_raster()` so the engines are
+    interchangeable: `min`, `max`, `mean`, and `sum` are the pixel value and
+    `std` is `0`.  Points outside of the raster or on a nodata pixel have a
+    value of `None` for every metric.
+
+    Parameters
+    ----------
+    vector : <fiona feature collection>
+        Vector datasource containing `Point` geometries.
+    raster : <rasterio RasterReader>
+        Raster datasource.
+    bands : int or list or None, optional
+        Bands to compute stats against.  Default is all.
+    vector_crs : dict or None, optional
+        CRS of the input features.  Defaults to `vector.crs`.
+
+    Raises
+    ------
+    click.ClickException
+        If a geometry is not a point.
+
+    Yields
+    ------
+    tuple
+        `(feature_id, stats)` in block order.  See `zonal_stats_from_raster()`.
+    """
+
+    if bands is None:
+        bands = list(range(1, raster.count + 1))
+    elif isinstance(bands, int):
+        bands = [bands]
+    else:
+        bands = sorted(bands)
+
+    if vector_crs is None:
+        vector_crs = vector.crs
+
+    fids = []
+    xs = []
+    ys = []
+    for feature in vector:
+        if feature['geometry']['type'] != 'Point':
+            raise click.ClickException(
+                "Feature `%s' is not a point: %s" % (feature['id'], feature['geometry']['type']))
+        x, y = feature['geometry']['coordinates'][:2]
+        fids.append(feature['id'])
+        xs.append(x)
+        ys.append(y)
+
+    if not fids:
+        return
+
+    if vector_crs != raster.crs:
+        xs, ys = transform(vector_crs, raster.crs, xs, ys)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+
+    inverse = ~raster.affine
+    cols = np.floor(inverse.a * xs + inverse.b * ys + inverse.c).astype(np.int64)
+    rows = np.floor(inverse.d * xs + inverse.e * ys + inverse.f).astype(np.int64)
+
+    r_x_min, r_y_min, r_x_max, r_y_max = raster.bounds
+    contained = (r_x_min <= xs) & (xs <= r_x_max) & (r_y_min <= ys) & (ys <= r_y_max)
+    inside = (rows >= 0) & (rows < raster.height) & (cols >= 0) & (cols < raster.width)
+
+    empty = dict.fromkeys(MetricAccumulator.metrics)
+    for idx in np.flatnonzero(~inside):
+        yield fids[idx], {
+            'bands': {bidx: dict(empty) for bidx in bands},
+            'contained': bool(contained[idx])
+        }
+
+    # Bucket points by block with a single sort
+    block_rows, block_cols = raster.block_shapes[0]
+    n_block_cols = int(math.ceil(raster.width / float(block_cols)))
+    indexes = np.flatnonzero(inside)
+    block_ids = (rows[indexes] // block_rows) * n_block_cols + cols[indexes] // block_cols
+    order = np.argsort(block_ids, kind='mergesort')
+    indexes = indexes[order]
+    block_ids = block_ids[order]
+
+    block_windows = dict(raster.block_windows())
+    unique_ids, starts = np.unique(block_ids, return_index=True)
+    for block_id, start, stop in zip(unique_ids, starts, np.append(starts[1:], len(indexes))):
+
+        window = block_windows[divmod(int(block_id), n_block_cols)]
+        (row_min, _), (col_min, _) = window
+
+        data = read_window(raster, bands, window, boundless=False)
+
+        points = indexes[start:stop]
+        p_rows = rows[points] - row_min
+        p_cols = cols[points] - col_min
+        values = data.data[:, p_rows, p_cols]
+        masked = np.ma.getmaskarray(data)[:, p_rows, p_cols]
+
+        for p, idx in enumerate(points):
+            stats = {'bands': {}, 'contained': bool(contained[idx])}
+            for i, bidx in enumerate(bands):
+                if masked[i, p]:
+                    stats['bands'][bidx] = dict(empty)
+                else:
+                    value = values[i, p]
+                    stats['bands'][bidx] = {
+                        'min': value,
+                        'max': value,
+                        'mean': value,
+                        'std': 0.0,
+                        'sum': value
+                    }
+            yield fids[idx], stats
+
+
+def zonal_stats_from_labels(vector, raster, bands=None, all_touched=False):
+
+    """
+    Compute zonal statistics for a tessellation of non-overlapping features,
+    like counties, watersheds, or grid cells, in a single pass over the raster.
+
+    Rather than rasterizing and reading a window for every feature, every
+    feature is assigned an integer label and an Rtree index is built from the
+    reprojected geometries.  For each raster block the intersecting features
+    are burned into a label raster with a single call to `rasterize()` and
+    every band is reduced with grouped aggregations (`np.bincount()`,
+    `np.minimum.at()`, and `np.maximum.at()`) to collect a per-label count,
+    sum, sum of squares, min, and max.  Metrics are derived from these
+    accumulators once all blocks have been processed.  The cost is one pass
+    over the raster plus one rasterization per block instead of
+    O(features * window), which matters when there are hundreds of thousands
+    of zones.
+
+    Features that overlap each other are NOT supported.  Each pixel belongs to
+    exactly one label and the last feature burned wins.  Custom metrics are
+    also not supported because the pixels for a feature are never collected
+    into a single array.
 
-        reproj_geom = asShape(transform_geom(
-            vector.crs, raster.crs, feature['geometry'], antimeridian_cutting=True))
+    The output is identical in structure to `zonal_stats_from_raster()`.
+    Features that do not intersect any valid pixels have a value of `None` for
+    every metric.
+
+    Parameters
+    ----------
+    vector : <fiona feature collection>
+        Vector datasource.
+    raster : <rasterio RasterReader>
+        Raster datasource.
+    bands : int or list or None, optional
+        Bands to compute stats against.  Default is all.
+    all_touched : bool, optional
+        Enable 'all-touched' rasterization.
+
+    Returns
+    -------
+    dict
+        See `zonal_stats_from_raster()`.
+    """
+
+    if bands is None:
+        bands = list(range(1, raster.count + 1))
+    elif isinstance(bands, int):
+        bands = [bands]
+    else:
+        bands = sorted(bands)
+
+    r_x_min, r_y_min, r_x_max, r_y_max = raster.bounds
+
+    # Label 0 is reserved for pixels that do not intersect a feature
+    fids = [None]
+    geometries = [None]
+    contained = [None]
+    index = Index()
+    for feature, reproj_geom in reproject_features(vector, vector.crs, raster.crs):
         x_min, y_min, x_max, y_max = reproj_geom.bounds
+        index.insert(len(fids), reproj_geom.bounds)
+        contained.append(
+            (r_x_min <= x_min <= x_max <= r_x_max) and (r_y_min <= y_min <= y_max <= r_y_max))
+        fids.append(feature['id'])
+        geometries.append(reproj_geom)
 
-        if (r_x_min <= x_min <= x_max <= r_x_max) and (r_y_min <= y_min <= y_max <= r_y_max):
-            stats['contained'] = True
-        else:
-            stats['contained'] = False
+    n_labels = len(fids)
+    count = np.zeros((len(bands), n_labels), dtype=np.int64)
+    total = np.zeros((len(bands), n_labels), dtype=np.float64)
+    total_sq = np.zeros((len(bands), n_labels), dtype=np.float64)
+    minimum = np.full((len(bands), n_labels), np.inf, dtype=np.float64)
+    maximum = np.full((len(bands), n_labels), -np.inf, dtype=np.float64)
+
+    for _, window in raster.block_windows():
+
+        ((row_min, row_max), (col_min, col_max)) = window
+        x_min, y_min = raster.affine * (col_min, row_max)
+        x_max, y_max = raster.affine * (col_max, row_min)
 
-        col_min, row_max = ~raster.affine * (x_min, y_min)
-        col_max, row_min = ~raster.affine * (x_max, y_max)
-        window = ((row_min, row_max), (col_min, col_max))
+        hits = list(index.intersection((x_min, y_min, x_max, y_max)))
+        if not hits:
+            continue
 
-        rasterized = rasterize(
-            shapes=[reproj_geom],
+        labels = rasterize(
+            shapes=((geometries[label], label) for label in hits),
             out_shape=(row_max - row_min, col_max - col_min),
-            fill=1,
+            fill=0,
             transform=raster.window_transform(window),
             all_touched=all_touched,
-            default_value=0,
-            dtype=rio.ubyte
-        ).astype(np.bool)
+            dtype=rio.uint32
+        )
 
-        for bidx in bands:
+        data = read_window(raster, bands, window, boundless=False)
 
-            stats['bands'][bidx] = {}
+        valid = ~np.ma.getmaskarray(data) & (labels > 0)
 
-            data = raster.read(indexes=bidx, window=window, boundless=True, masked=True)
+        for i in range(len(bands)):
+            band_labels = labels[valid[i]]
+            values = data.data[i][valid[i]].astype(np.float64)
+            count[i] += np.bincount(band_labels, minlength=n_labels)
+            total[i] += np.bincount(band_labels, weights=values, minlength=n_labels)
+            total_sq[i] += np.bincount(band_labels, weights=values ** 2, minlength=n_labels)
+            np.minimum.at(minimum[i], band_labels, values)
+            np.maximum.at(maximum[i], band_labels, values)
 
-            # This should be a masked array, but a bug requires us to build our own:
-            # https://github.com/mapbox/rasterio/issues/338
-            if not isinstance(data, np.ma.MaskedArray):
-                data = np.ma.array(data, mask=data == raster.nodata)
+    feature_stats = {}
+    for label in range(1, n_labels):
+        stats = {'bands': {}, 'contained': contained[label]}
+        for i, bidx in enumerate(bands):
+            n = count[i, label]
+            if n == 0:
+                stats['bands'][bidx] = dict.fromkeys(MetricAccumulator.metrics)
+                continue
+            mean = total[i, label] / n
+            stats['bands'][bidx] = {
+                'min': minimum[i, label],
+                'max': maximum[i, label],
+                'mean': mean,
+                'std': np.sqrt(max(total_sq[i, label] / n - mean ** 2, 0)),
+                'sum': total[i, label]
+            }
+        feature_stats[fids[label]] = stats
 
-            data.mask += rasterized
+    return feature_stats
 
-            for name, func in metrics.items():
-                if func is not None:
-                    stats['bands'][bidx][name] = func(data)
 
-            feature_stats[feature['id']] = stats
+class ResultCache(object):
 
-    return feature_stats
+    """
+    Persistent on-disk cache of per-feature zonal statistics backed by SQLite
+    so that reruns only compute stats for new or edited features.
+
+    Entries are keyed on a hash of the feature's geometry and CRS plus
+    everything else that influences the result: the raster's fingerprint
+    (absolute path, modification time, size, and affine transformation), the
+    bands, `all_touched`, and `approximate`.  Touching the raster or changing any option
+    invalidates every entry because the key no longer matches.  Feature ID's
+    are not part of the key so renumbered features are still served from the
+    cache.
+
+    Entries track when they were last used and the least recently used
+    entries beyond `max_entries` are evicted when the cache is closed.  New
+    entries are committed every `commit_every` puts so a crashed or killed
+    run only loses its most recent results.  Custom metrics are not supported
+    because functions cannot be fingerprinted.  Stats are stored as JSON so
+    reading a shared or modified cache cannot execute code.
+    """
+
+    version = 2
+
+    def __init__(self, path, raster, vector_crs, bands, all_touched, max_entries=None,
+                 approximate=None, commit_every=1000):
+
+        """
+        Parameters
+        ----------
+        path : str
+            SQLite database.  Created if it does not exist.
+        raster : <rasterio RasterReader>
+            Raster datasource.
+        vector_crs : dict
+            CRS of the features that will be looked up.
+        bands : list
+            Bands stats are computed against.
+        all_touched : bool
+            Whether 'all-touched' rasterization is enabled.
+        max_entries : int or None, optional
+            Keep at most this many entries.  Default is unlimited.
+        approximate : int or None, optional
+            See `zonal_stats_from_raster()`.
+        commit_every : int, optional
+            Commit after this many calls to `put()`.
+        """
+
+        stat = os.stat(raster.name)
+        self.context = json.dumps([
+            self.version,
+            os.path.abspath(raster.name), stat.st_mtime, stat.st_size, tuple(raster.affine),
+            vector_crs, sorted(bands), bool(all_touched), approximate
+        ], sort_keys=True)
+        self.max_entries = max_entries
+        self.commit_every = commit_every
+        self.pending = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, stats TEXT NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def key(self, feature):
+
+        """
+        Compute a feature's cache key.
+        """
+
+        geometry = json.dumps(feature['geometry'], sort_keys=True)
+        return hashlib.sha1((self.context + geometry).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+
+        """
+        Get cached stats and mark them as recently used.
+
+        Returns
+        -------
+        dict or None
+            `None` if the key is not in the cache.
+        """
+
+        row = self.connection.execute(
+            "SELECT stats FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute(
+            "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        stats = json.loads(row[0])
+        # JSON object keys are always strings
+        stats['bands'] = {int(bidx): values for bidx, values in stats['bands'].items()}
+        if 'resolution' in stats:
+            stats['resolution'] = tuple(stats['resolution'])
+        return stats
+
+    def put(self, key, stats):
+
+        """
+        Add stats to the cache.  Committed every `commit_every` calls.
+        """
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, stats, last_used) VALUES (?, ?, ?)",
+            (key, json.dumps(stats, default=json_default), time.time()))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.connection.commit()
+            self.pending = 0
+
+    def evict(self):
+
+        """
+        Delete the least recently used entries beyond `max_entries`.
+        """
+
+        if self.max_entries is not None:
+            self.connection.execute(
+                "DELETE FROM results WHERE key NOT IN ("
+                "SELECT key FROM results ORDER BY last_used DESC LIMIT ?)", (self.max_entries,))
+
+    def close(self):
+
+        """
+        Evict, commit, and close the database.
+        """
+
+        self.evict()
+        self.connection.commit()
+        self.connection.close()
+
+
+def iter_cached_zonal_stats(vector, cache, compute):
+
+    """
+    Serve zonal stats from a `ResultCache` and only compute stats for features
+    that are not in the cache.
+
+    Cached features are yielded while the vector datasource is being read and
+    the remaining features are then passed to `compute` all at once.  New
+    results are added to the cache as they are yielded.
+
+    Parameters
+    ----------
+    vector : <fiona feature collection>
+        Vector datasource.
+    cache : ResultCache
+        Cache to read from and write to.
+    compute : callable
+        Receives a list of features missing from the cache and returns an
+        iterable producing `(feature_id, stats)` like `iter_zonal_stats()`.
+
+    Yields
+    ------
+    tuple
+        `(feature_id, stats)`.  Cached features first.
+    """
+
+    misses = []
+    keys = {}
+    for feature in vector:
+        key = cache.key(feature)
+        stats = cache.get(key)
+        if stats is None:
+            misses.append(feature)
+            keys[feature['id']] = key
+        else:
+            yield feature['id'], stats
+
+    if misses:
+        for fid, stats in compute(misses):
+            cache.put(keys[fid], stats)
+            yield fid, stats
+
+
+def json_default(obj):
+
+    """
+    Convert the NumPy objects that appear in zonal stats into something the
+    `json` module can serialize.  Used as `json.dumps(default=json_default)`.
+    """
+
+    if obj is np.ma.masked:
+        return None
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    else:
+        raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+def write_ndjson(results, stream, batch_size=1000):
+
+    """
+    Write `(feature_id, stats)` pairs as newline delimited JSON, one feature
+    per line, and flush every `batch_size` lines so downstream consumers can
+    start processing immediately.
+
+    Parameters
+    ----------
+    results : iter
+        Produces `(feature_id, stats)` like `iter_zonal_stats()`.
+    stream : file
+        Open file-like object.
+    batch_size : int, optional
+        Number of features to write between flushes.
+    """
+
+    for idx, (fid, stats) in enumerate(results, 1):
+        stream.write(json.dumps(dict(stats, id=fid), default=json_default) + '\n')
+        if idx % batch_size == 0:
+            stream.flush()
+    stream.flush()
 
 
 @click.command()
@@ -245,7 +1755,56 @@ def zonal_stats_from_raster(vector, raster, bands=None, all_touched=False, custo
     '--indent', type=click.INT, default=0,
     help="Pretty print indent."
 )
-def main(raster, vector, bands, all_touched, no_pretty_print, indent):
+@click.option(
+    '--coalesce-blocks', is_flag=True,
+    help="Read each raster block only once.  Best for dense or overlapping features.  Only "
+         "supported by the 'window' engine."
+)
+@click.option(
+    '-e', '--engine', type=click.Choice(['window', 'label', 'point']), default='window',
+    help="Compute stats per feature window, with a single pass over a label raster, or by "
+         "sampling points.  The 'label' engine only supports non-overlapping features and "
+         "the 'point' engine only supports points."
+)
+@click.option(
+    '-w', '--workers', type=click.IntRange(1), default=1,
+    help="Number of worker processes.  Only supported by the 'window' engine."
+)
+@click.option(
+    '--ndjson', is_flag=True,
+    help="Stream one JSON object per feature as soon as it is computed."
+)
+@click.option(
+    '--batch-size', type=click.IntRange(1), default=1000,
+    help="Number of features to write between flushes with --ndjson."
+)
+@click.option(
+    '--max-window-pixels', type=click.IntRange(1), metavar='INT',
+    help="Split feature windows with more pixels than this into block aligned sub-windows "
+         "to bound memory usage.  Only supported by the 'window' engine."
+)
+@click.option(
+    '--prefetch', type=click.IntRange(0), default=0, metavar='INT',
+    help="Read this many windows ahead on background threads.  Only supported by the "
+         "'window' engine without --coalesce-blocks."
+)
+@click.option(
+    '--cache', 'cache_path', metavar='FILE',
+    help="SQLite database caching per-feature results between runs.  Only new or edited "
+         "features are computed.  Only supported by the 'window' engine."
+)
+@click.option(
+    '--cache-size', type=click.IntRange(1), default=1000000, metavar='INT',
+    help="Maximum number of features to keep in --cache.  Least recently used are evicted."
+)
+@click.option(
+    '--approximate', type=click.IntRange(1), metavar='MIN_PIXELS',
+    help="Read each feature from the coarsest overview that still places at least this "
+         "many pixels inside the feature.  Only supported by the 'window' engine."
+)
+def main(raster, vector, bands, all_touched, no_pretty_print, indent, coalesce_blocks, engine,
+         workers, ndjson, batch_size, max_window_pixels, prefetch, cache_path, cache_size,
+         approximate):
 
     """
     Get raster stats for every feature in a vector datasource.
@@ -256,21 +1815,110 @@ def main(raster, vector, bands, all_touched, no_pretty_print, indent):
         $ zonal-statistics.py sample-data/NAIP.tif \\
             sample-data/polygon-samples.geojson -b 1,2
     \b
+    Read each raster block only once when features overlap heavily:
+    \b
+        $ zonal-statistics.py sample-data/NAIP.tif \\
+            sample-data/polygon-samples.geojson --coalesce-blocks
+    \b
+    Single pass over the raster for a large number of non-overlapping zones:
+    \b
+        $ zonal-statistics.py sample-data/NAIP.tif \\
+            sample-data/polygon-samples.geojson --engine label
+    \b
+    Sample a DEM at every point without rasterizing:
+    \b
+        $ zonal-statistics.py sample-data/DEM.tif \\
+            sample-data/point-sample.geojson --engine point
+    \b
+    Spread the work across 8 processes:
+    \b
+        $ zonal-statistics.py sample-data/NAIP.tif \\
+            sample-data/polygon-samples.geojson --workers 8
+    \b
+    Stream newline delimited JSON to another process:
+    \b
+        $ zonal-statistics.py sample-data/NAIP.tif \\
+            sample-data/polygon-samples.geojson --ndjson | jq .bands
+    \b
+    Only compute stats for features that changed since the last run:
+    \b
+        $ zonal-statistics.py sample-data/NAIP.tif \\
+            sample-data/polygon-samples.geojson --cache stats.sqlite
+    \b
+    Fast approximate stats from overviews with at least 1000 pixels per feature:
+    \b
+        $ zonal-statistics.py sample-data/NAIP.tif \\
+            sample-data/polygon-samples.geojson --approximate 1000
+    \b
     """
 
+    if engine != 'window':
+        window_options = (
+            ('--workers', workers > 1),
+            ('--cache', cache_path),
+            ('--coalesce-blocks', coalesce_blocks),
+            ('--max-window-pixels', max_window_pixels),
+            ('--prefetch', prefetch),
+            ('--approximate', approximate))
+        for name, value in window_options:
+            if value:
+                raise click.BadParameter("%s is only supported by the 'window' engine." % name)
+
     with fio.drivers(), rio.drivers():
         with rio.open(raster) as src_r, fio.open(vector) as src_v:
 
             if not bands:
                 bands = list(range(1, src_r.count + 1))
 
-            results = zonal_stats_from_raster(
-                src_v, src_r, bands=bands, all_touched=all_touched)
+            options = {
+                'bands': bands,
+                'all_touched': all_touched,
+                'coalesce_blocks': coalesce_blocks,
+                'max_window_pixels': max_window_pixels,
+                'prefetch': prefetch,
+                'approximate': approximate
+            }
+
+            if workers > 1:
+                def compute(features=None):
+                    fids = None if features is None else [f['id'] for f in features]
+                    return iter_zonal_stats_parallel(vector, raster, workers, fids=fids, **options)
+            else:
+                def compute(features=None):
+                    return iter_zonal_stats(
+                        src_v if features is None else features, src_r,
+                        vector_crs=src_v.crs, **options)
+
+            cache = None
+            try:
+                if engine == 'label':
+                    results = zonal_stats_from_labels(
+                        src_v, src_r, bands=bands, all_touched=all_touched).items()
+                elif engine == 'point':
+                    results = iter_zonal_stats_from_points(src_v, src_r, bands=bands)
+                elif cache_path:
+                    cache = ResultCache(
+                        cache_path, src_r, src_v.crs, bands, all_touched, max_entries=cache_size,
+                        approximate=approximate)
+                    results = iter_cached_zonal_stats(src_v, cache, compute)
+                else:
+                    results = compute()
+
+                if ndjson:
+                    write_ndjson(results, click.get_text_stream('stdout'), batch_size=batch_size)
+
+                else:
+                    results = dict(results)
+
+                    if not no_pretty_print:
+                        results = pprint.pformat(results, indent=indent)
 
-            if not no_pretty_print:
-                results = pprint.pformat(results, indent=indent)
+                    click.echo(results)
 
-            click.echo(results)
+            # Keep everything computed before a failure
+            finally:
+                if cache is not None:
+                    cache.close()
 
 
 if __name__ == '__main__':